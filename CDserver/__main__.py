@@ -1,6 +1,5 @@
 import argparse
 import contextlib
-import os
 import signal
 import socket
 import sys
@@ -17,6 +16,11 @@ def run():
 
     shutdown_socket, shutdown_socket_out = socket.socketpair()
 
+    # Send instead of closing the socket, forked workers share it
+    def shutdown_signal_handler(signal_number, stack_frame):
+        shutdown_socket.send(b"\0")
+    signal.signal(signal.SIGTERM, shutdown_signal_handler)
+
     try:
         server.serve(configuration, shutdown_socket_out, login)
     except Exception as e:
@@ -1,6 +1,7 @@
 import base64
 import datetime
 import io
+import itertools
 import logging
 from os import environ
 import posixpath
@@ -9,13 +10,12 @@ import random
 import sys
 import time
 import xml.etree.ElementTree as ET
-import zlib
 from http import client
 
 import pkg_resources
 
-from CDserver import (auth, httputils, log, pathutils, rights, storage, web,
-                      xmlutils)
+from CDserver import (auth, httputils, log, pathutils, provision, rights,
+                      storage, web, xmlutils)
 from CDserver.app.delete import ApplicationDeleteMixin
 from CDserver.app.get import ApplicationGetMixin
 from CDserver.app.head import ApplicationHeadMixin
@@ -50,7 +50,32 @@ class Application(
         self._storage = storage.load(configuration)
         self._rights = rights.load(configuration)
         self._web = web.load(configuration)
+        self._provisioner = provision.Provisioner(self._storage)
         self._encoding = configuration.get("encoding", "request")
+        self._compression_level = configuration.get(
+            "server", "compression_level")
+        self._compression_min_size = configuration.get(
+            "server", "compression_min_size")
+
+    def provision(self, user):
+        """Create the principal and default address book of ``user``."""
+        self._provisioner.provision(user)
+
+    def close(self):
+        """Finish the work that is done in the background."""
+        self._storage.close()
+
+    def _select_content_encoding(self, environ, size):
+        """Get the content coding for an answer of ``size`` bytes.
+
+        Returns ``None`` if the answer should be sent uncompressed.
+
+        """
+        if (not self._compression_level or
+                size < self._compression_min_size):
+            return None
+        return httputils.select_content_encoding(
+            environ.get("HTTP_ACCEPT_ENCODING", ""))
 
     def _headers_log(self, environ):
         request_environ = dict(environ)
@@ -93,23 +118,48 @@ class Application(
     def _handle_request(self, environ):
         def response(status, headers=(), answer=None):
             headers = dict(headers)
-            # Set content length
+            answers = []
+            if answer is not None and not isinstance(answer, (str, bytes)):
+                chunks = iter(answer)
+                first_chunk = next(chunks, None)
+                if isinstance(first_chunk, str):
+                    headers["Content-Type"] += "; charset=%s" % self._encoding
+                blocks = httputils.buffer_chunks(
+                    itertools.chain((first_chunk,), chunks)
+                    if first_chunk is not None else (), self._encoding)
+                answer = next(blocks, b"")
+                if len(answer) >= httputils.CHUNK_SIZE:
+                    # Stream the answer, the content length is unknown
+                    answers = itertools.chain((answer,), blocks)
+                    content_encoding = self._select_content_encoding(
+                        environ, len(answer))
+                    if content_encoding:
+                        answers = httputils.compress_chunks(
+                            answers, content_encoding,
+                            self._compression_level)
+                        headers["Content-Encoding"] = content_encoding
+                    if self._compression_level:
+                        headers["Vary"] = "Accept-Encoding"
+                    answer = None
             if answer:
                 if hasattr(answer, "encode"):
                     logger.debug("Response content:\n%s", answer)
                     headers["Content-Type"] += "; charset=%s" % self._encoding
                     answer = answer.encode(self._encoding)
-                accept_encoding = [
-                    encoding.strip() for encoding in
-                    environ.get("HTTP_ACCEPT_ENCODING", "").split(",")
-                    if encoding.strip()]
 
-                if "gzip" in accept_encoding:
-                    zcomp = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
-                    answer = zcomp.compress(answer) + zcomp.flush()
-                    headers["Content-Encoding"] = "gzip"
+                # Decided by the uncompressed size, like the compression
+                if (self._compression_level and
+                        len(answer) >= self._compression_min_size):
+                    headers["Vary"] = "Accept-Encoding"
+                content_encoding = self._select_content_encoding(
+                    environ, len(answer))
+                if content_encoding:
+                    answer = httputils.compress(
+                        answer, content_encoding, self._compression_level)
+                    headers["Content-Encoding"] = content_encoding
 
                 headers["Content-Length"] = str(len(answer))
+                answers = [answer]
 
             for key in self.configuration.options("headers"):
                 headers[key] = self.configuration.get("headers", key)
@@ -121,7 +171,7 @@ class Application(
                 "%s response status for %r%s in %.3f seconds: %s",
                 environ["REQUEST_METHOD"], environ.get("PATH_INFO", ""),
                 depthinfo, (time_end - time_begin).total_seconds(), status)
-            return status, list(headers.items()), [answer] if answer else []
+            return status, list(headers.items()), answers
 
         remote_host = "unknown"
         if environ.get("REMOTE_HOST"):
@@ -174,6 +224,8 @@ class Application(
                     authorization.encode("ascii"))).split(":", 1)
 
         user = self._auth.login(login, password) or "" if login else ""
+        if user and self.configuration.get("storage", "auto_provision"):
+            self.provision(user)
 
         if self.configuration.get("server", "_internal_server"):
             content_length = int(environ.get("CONTENT_LENGTH") or 0)
@@ -184,6 +236,12 @@ class Application(
                     logger.info("Request body too large: %d", content_length)
                     return response(*httputils.REQUEST_ENTITY_TOO_LARGE)
 
+        content_encoding = httputils.get_request_content_encoding(environ)
+        if content_encoding not in httputils.REQUEST_CONTENT_ENCODINGS:
+            logger.info("Unsupported content encoding of request body: %r",
+                        content_encoding)
+            return response(*httputils.UNSUPPORTED_CONTENT_ENCODING)
+
         if not login or user:
             status, headers, answer = function(
                 environ, base_prefix, path, user)
@@ -229,6 +287,26 @@ class Application(
                                           xml_declaration=True)
         return f.getvalue()
 
+    def _xml_response_chunks(self, xml_content, elements=()):
+        """Serialize ``xml_content`` with ``elements`` appended to it.
+
+        The children are serialized one at a time while the answer is sent,
+        ``elements`` can be generated lazily.
+
+        """
+        # Split the serialized root element to insert the children
+        root = ET.Element(xml_content.tag, xml_content.attrib)
+        root.text = "\0"
+        start, end = ET.tostring(root, "unicode").split("\0")
+        yield "<?xml version='1.0' encoding='%s'?>\n" % self._encoding
+        yield start
+        for element in itertools.chain(xml_content, elements):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response content:\n%s",
+                             xmlutils.pretty_xml(element))
+            yield ET.tostring(element, "unicode")
+        yield end
+
     def _webdav_error_response(self, status, human_tag):
         headers = {"Content-Type": "text/xml; charset=%s" % self._encoding}
         content = self._xml_response(xmlutils.webdav_error(human_tag))
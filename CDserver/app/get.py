@@ -50,7 +50,7 @@ class ApplicationGetMixin:
         access = app.Access(self._rights, user, path)
         if not access.check("r") and "i" not in access.permissions:
             return httputils.NOT_ALLOWED
-        with self._storage.acquire_lock("r", user):
+        with self._storage.acquire_lock("r", user, [path]):
             item = next(self._storage.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
@@ -79,5 +79,11 @@ class ApplicationGetMixin:
                 "ETag": item.etag}
             if content_disposition:
                 headers["Content-Disposition"] = content_disposition
-            answer = item.serialize()
+            if (isinstance(item, storage.BaseCollection) and
+                    tag == "VADDRESSBOOK"):
+                # The items are retrieved while the storage is locked, their
+                # text is read from the snapshot while the answer is sent
+                answer = (i.serialize() for i in list(item.get_all()))
+            else:
+                answer = item.serialize()
             return client.OK, headers, answer
@@ -26,7 +26,7 @@ class ApplicationMoveMixin:
         if not to_access.check("w"):
             return httputils.NOT_ALLOWED
 
-        with self._storage.acquire_lock("w", user):
+        with self._storage.acquire_lock("w", user, [path, to_path]):
             item = next(self._storage.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
@@ -316,7 +316,7 @@ class ApplicationPropfindMixin:
         except socket.timeout:
             logger.debug("Client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
-        with self._storage.acquire_lock("r", user):
+        with self._storage.acquire_lock("r", user, [path]):
             items = self._storage.discover(
                 path, environ.get("HTTP_DEPTH", "0"))
             item = next(items, None)
@@ -52,7 +52,7 @@ class ApplicationProppatchMixin:
         except socket.timeout:
             logger.debug("Client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
-        with self._storage.acquire_lock("w", user):
+        with self._storage.acquire_lock("w", user, [path]):
             item = next(self._storage.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
@@ -16,10 +16,15 @@ MIMETYPE_TAGS = {value: key for key, value in xmlutils.MIMETYPES.items()}
 
 def prepare(vobject_items, path, content_type, permissions, parent_permissions,
             tag=None, write_whole_collection=None):
+    # The tag is predicted from the first components, the components of
+    # address books are parsed and prepared one at a time.
+    # Raises an exception if the first components can't be parsed.
+    vobject_items = iter(vobject_items)
+    first_vobject_items = list(itertools.islice(vobject_items, 2))
     if (write_whole_collection or permissions and not parent_permissions):
         write_whole_collection = True
         tag = CDserver_item.predict_tag_of_whole_collection(
-            vobject_items, MIMETYPE_TAGS.get(content_type))
+            first_vobject_items, MIMETYPE_TAGS.get(content_type))
         if not tag:
             raise ValueError("Can't determine collection tag")
         collection_path = pathutils.strip_path(path)
@@ -27,13 +32,27 @@ def prepare(vobject_items, path, content_type, permissions, parent_permissions,
           not permissions and parent_permissions):
         write_whole_collection = False
         if tag is None:
-            tag = CDserver_item.predict_tag_of_parent_collection(vobject_items)
+            tag = CDserver_item.predict_tag_of_parent_collection(
+                first_vobject_items)
         collection_path = posixpath.dirname(pathutils.strip_path(path))
     props = None
     stored_exc_info = None
     items = []
     try:
-        if tag:
+        if write_whole_collection and tag == "VADDRESSBOOK":
+            # Generated UIDs must not collide with the UIDs of the
+            # components that were checked separately
+            uids = set()
+            for vobject_item in itertools.chain(first_vobject_items,
+                                                vobject_items):
+                CDserver_item.check_and_sanitize_items(
+                    [vobject_item], is_collection=True, tag=tag, uids=uids)
+                item = CDserver_item.Item(collection_path=collection_path,
+                                          vobject_item=vobject_item)
+                item.prepare(keep_vobject_item=False)
+                items.append(item)
+        elif tag:
+            vobject_items = first_vobject_items + list(vobject_items)
             CDserver_item.check_and_sanitize_items(
                 vobject_items, is_collection=write_whole_collection, tag=tag)
             if write_whole_collection and tag == "VCALENDAR":
@@ -53,12 +72,6 @@ def prepare(vobject_items, path, content_type, permissions, parent_permissions,
                                               vobject_item=vobject_collection)
                     item.prepare()
                     items.append(item)
-            elif write_whole_collection and tag == "VADDRESSBOOK":
-                for vobject_item in vobject_items:
-                    item = CDserver_item.Item(collection_path=collection_path,
-                                              vobject_item=vobject_item)
-                    item.prepare()
-                    items.append(item)
             elif not write_whole_collection:
                 vobject_item, = vobject_items
                 item = CDserver_item.Item(collection_path=collection_path,
@@ -70,13 +83,13 @@ def prepare(vobject_items, path, content_type, permissions, parent_permissions,
             props = {}
             if tag:
                 props["tag"] = tag
-            if tag == "VCALENDAR" and vobject_items:
-                if hasattr(vobject_items[0], "x_wr_calname"):
-                    calname = vobject_items[0].x_wr_calname.value
+            if tag == "VCALENDAR" and first_vobject_items:
+                if hasattr(first_vobject_items[0], "x_wr_calname"):
+                    calname = first_vobject_items[0].x_wr_calname.value
                     if calname:
                         props["D:displayname"] = calname
-                if hasattr(vobject_items[0], "x_wr_caldesc"):
-                    caldesc = vobject_items[0].x_wr_caldesc.value
+                if hasattr(first_vobject_items[0], "x_wr_caldesc"):
+                    caldesc = first_vobject_items[0].x_wr_caldesc.value
                     if caldesc:
                         props["C:calendar-description"] = caldesc
             CDserver_item.check_and_sanitize_props(props)
@@ -96,27 +109,42 @@ class ApplicationPutMixin:
         if not access.check("w"):
             return httputils.NOT_ALLOWED
         try:
-            content = httputils.read_request_body(self.configuration, environ)
+            body = httputils.spool_request_body(self.configuration, environ)
         except RuntimeError as e:
             logger.warning("Bad PUT request on %r: %s", path, e, exc_info=True)
             return httputils.BAD_REQUEST
         except socket.timeout:
             logger.debug("Client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
+        with body:
+            return self._put(environ, path, user, access, body)
+
+    def _put(self, environ, path, user, access, body):
         content_type = environ.get("CONTENT_TYPE", "").split(";")[0]
         try:
-            vobject_items = tuple(vobject.readComponents(content or ""))
+            content = httputils.decode_request_stream(
+                self.configuration, environ, body)
+        except UnicodeDecodeError as e:
+            logger.warning(
+                "Bad PUT request on %r: %s", path, e, exc_info=True)
+            return httputils.BAD_REQUEST
+
+        def read_vobject_items():
+            content.seek(0)
+            return CDserver_item.read_components(content)
+
+        try:
+            (prepared_items, prepared_tag, prepared_write_whole_collection,
+             prepared_props, prepared_exc_info) = prepare(
+                 read_vobject_items(), path, content_type,
+                 bool(rights.intersect(access.permissions, "Ww")),
+                 bool(rights.intersect(access.parent_permissions, "w")))
         except Exception as e:
             logger.warning(
                 "Bad PUT request on %r: %s", path, e, exc_info=True)
             return httputils.BAD_REQUEST
-        (prepared_items, prepared_tag, prepared_write_whole_collection,
-         prepared_props, prepared_exc_info) = prepare(
-             vobject_items, path, content_type,
-             bool(rights.intersect(access.permissions, "Ww")),
-             bool(rights.intersect(access.parent_permissions, "w")))
 
-        with self._storage.acquire_lock("w", user):
+        with self._storage.acquire_lock("w", user, [path]):
             item = next(self._storage.discover(path), None)
             parent_item = next(
                 self._storage.discover(access.parent_path), None)
@@ -152,7 +180,7 @@ class ApplicationPutMixin:
                     prepared_write_whole_collection != write_whole_collection):
                 (prepared_items, prepared_tag, prepared_write_whole_collection,
                  prepared_props, prepared_exc_info) = prepare(
-                     vobject_items, path, content_type,
+                     read_vobject_items(), path, content_type,
                      bool(rights.intersect(access.permissions, "Ww")),
                      bool(rights.intersect(access.parent_permissions, "w")),
                      tag, write_whole_collection)
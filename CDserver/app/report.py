@@ -1,4 +1,5 @@
 import contextlib
+import itertools
 import posixpath
 import socket
 import xml.etree.ElementTree as ET
@@ -11,15 +12,22 @@ from CDserver.log import logger
 
 
 def xml_report(base_prefix, path, xml_request, collection, encoding,
-               unlock_storage_fn):
+               unlock_storage_fn, max_sync_results=0):
     """Read and answer REPORT requests.
 
     Read rfc3253-3.6 for info.
 
+    ``max_sync_results`` limits the number of changes in the answer to
+    sync-collection requests (``0`` for no limit).
+
+    Returns the status, the root element of the answer and an iterable of
+    additional child elements. The item responses are generated lazily,
+    after the storage was unlocked.
+
     """
     multistatus = ET.Element(xmlutils.make_clark("D:multistatus"))
     if xml_request is None:
-        return client.MULTI_STATUS, multistatus
+        return client.MULTI_STATUS, multistatus, ()
     root = xml_request
     if root.tag in (
             xmlutils.make_clark("D:principal-search-property-set"),
@@ -27,7 +35,7 @@ def xml_report(base_prefix, path, xml_request, collection, encoding,
             xmlutils.make_clark("D:expand-property")):
         logger.warning("Unsupported REPORT method %r on %r requested",
                        xmlutils.make_human_tag(root.tag), path)
-        return client.MULTI_STATUS, multistatus
+        return client.MULTI_STATUS, multistatus, ()
     if (root.tag == xmlutils.make_clark("C:calendar-multiget") and
             collection.get_meta("tag") != "VCALENDAR" or
             root.tag == xmlutils.make_clark("CR:addressbook-multiget") and
@@ -37,8 +45,9 @@ def xml_report(base_prefix, path, xml_request, collection, encoding,
         logger.warning("Invalid REPORT method %r on %r requested",
                        xmlutils.make_human_tag(root.tag), path)
         return (client.FORBIDDEN,
-                xmlutils.webdav_error("D:supported-report"))
+                xmlutils.webdav_error("D:supported-report"), ())
     prop_element = root.find(xmlutils.make_clark("D:prop"))
+    truncated_responses = []
     props = (
         [prop.tag for prop in prop_element]
         if prop_element is not None else [])
@@ -62,18 +71,37 @@ def xml_report(base_prefix, path, xml_request, collection, encoding,
         if old_sync_token_element is not None and old_sync_token_element.text:
             old_sync_token = old_sync_token_element.text.strip()
         logger.debug("Client provided sync token: %r", old_sync_token)
+        limit = max_sync_results or None
+        nresults_element = root.find("%s/%s" % (
+            xmlutils.make_clark("D:limit"), xmlutils.make_clark("D:nresults")))
+        if nresults_element is not None:
+            try:
+                nresults = int(nresults_element.text or "")
+            except ValueError:
+                nresults = 0
+            if nresults <= 0:
+                raise ValueError("Invalid limit: %r" % nresults_element.text)
+            limit = min(nresults, limit or nresults)
         try:
-            sync_token, names = collection.sync(old_sync_token)
+            sync_token, names, sync_complete = collection.sync_page(
+                old_sync_token, limit)
         except ValueError as e:
             logger.warning("Client provided invalid sync token %r: %s",
                            old_sync_token, e, exc_info=True)
             return (client.FORBIDDEN,
-                    xmlutils.webdav_error("D:valid-sync-token"))
+                    xmlutils.webdav_error("D:valid-sync-token"), ())
         hreferences = (pathutils.unstrip_path(
             posixpath.join(collection.path, n)) for n in names)
         sync_token_element = ET.Element(xmlutils.make_clark("D:sync-token"))
         sync_token_element.text = sync_token
         multistatus.append(sync_token_element)
+        if not sync_complete:
+            logger.debug("Sync-collection response truncated to %d changes",
+                         limit)
+            # rfc6578-3.6: the remaining changes are fetched with the
+            # returned sync token
+            truncated_responses.append(xml_truncated_response(
+                base_prefix, pathutils.unstrip_path(collection.path, True)))
     else:
         hreferences = (path,)
     filters = (
@@ -115,6 +143,7 @@ def xml_report(base_prefix, path, xml_request, collection, encoding,
     retrieved_items = list(retrieve_items(collection, hreferences,
                                           multistatus))
     collection_tag = collection.get_meta("tag")
+    # The text of the retrieved items is read from their snapshot
     unlock_storage_fn()
 
     def match(item, filter_):
@@ -145,45 +174,47 @@ def xml_report(base_prefix, path, xml_request, collection, encoding,
             raise ValueError("Unsupported filter test: %r" % test)
         raise ValueError("Unsupported filter %r for %r" % (filter_.tag, tag))
 
-    while retrieved_items:
-        item, filters_matched = retrieved_items.pop(0)
-        if filters and not filters_matched:
-            try:
-                if not all(match(item, filter_) for filter_ in filters):
-                    continue
-            except ValueError as e:
-                raise ValueError("Failed to filter item %r from %r: %s" %
-                                 (item.href, collection.path, e)) from e
-            except Exception as e:
-                raise RuntimeError("Failed to filter item %r from %r: %s" %
-                                   (item.href, collection.path, e)) from e
-
-        found_props = []
-        not_found_props = []
-
-        for tag in props:
-            element = ET.Element(tag)
-            if tag == xmlutils.make_clark("D:getetag"):
-                element.text = item.etag
-                found_props.append(element)
-            elif tag == xmlutils.make_clark("D:getcontenttype"):
-                element.text = xmlutils.get_content_type(item, encoding)
-                found_props.append(element)
-            elif tag in (
-                    xmlutils.make_clark("C:calendar-data"),
-                    xmlutils.make_clark("CR:address-data")):
-                element.text = item.serialize()
-                found_props.append(element)
-            else:
-                not_found_props.append(element)
+    def responses():
+        while retrieved_items:
+            item, filters_matched = retrieved_items.pop(0)
+            if filters and not filters_matched:
+                try:
+                    if not all(match(item, filter_) for filter_ in filters):
+                        continue
+                except ValueError as e:
+                    raise ValueError("Failed to filter item %r from %r: %s" %
+                                     (item.href, collection.path, e)) from e
+                except Exception as e:
+                    raise RuntimeError("Failed to filter item %r from %r: %s" %
+                                       (item.href, collection.path, e)) from e
+
+            found_props = []
+            not_found_props = []
+
+            for tag in props:
+                element = ET.Element(tag)
+                if tag == xmlutils.make_clark("D:getetag"):
+                    element.text = item.etag
+                    found_props.append(element)
+                elif tag == xmlutils.make_clark("D:getcontenttype"):
+                    element.text = xmlutils.get_content_type(item, encoding)
+                    found_props.append(element)
+                elif tag in (
+                        xmlutils.make_clark("C:calendar-data"),
+                        xmlutils.make_clark("CR:address-data")):
+                    element.text = item.serialize()
+                    found_props.append(element)
+                else:
+                    not_found_props.append(element)
 
-        uri = pathutils.unstrip_path(
-            posixpath.join(collection.path, item.href))
-        multistatus.append(xml_item_response(
-            base_prefix, uri, found_props=found_props,
-            not_found_props=not_found_props, found_item=True))
+            uri = pathutils.unstrip_path(
+                posixpath.join(collection.path, item.href))
+            yield xml_item_response(
+                base_prefix, uri, found_props=found_props,
+                not_found_props=not_found_props, found_item=True)
 
-    return client.MULTI_STATUS, multistatus
+    return (client.MULTI_STATUS, multistatus,
+            itertools.chain(responses(), truncated_responses))
 
 
 def xml_item_response(base_prefix, href, found_props=(), not_found_props=(),
@@ -214,6 +245,25 @@ def xml_item_response(base_prefix, href, found_props=(), not_found_props=(),
     return response
 
 
+def xml_truncated_response(base_prefix, href):
+    response = ET.Element(xmlutils.make_clark("D:response"))
+
+    href_element = ET.Element(xmlutils.make_clark("D:href"))
+    href_element.text = xmlutils.make_href(base_prefix, href)
+    response.append(href_element)
+
+    status = ET.Element(xmlutils.make_clark("D:status"))
+    status.text = xmlutils.make_response(507)
+    response.append(status)
+
+    error = ET.Element(xmlutils.make_clark("D:error"))
+    error.append(ET.Element(
+        xmlutils.make_clark("D:number-of-matches-within-limits")))
+    response.append(error)
+
+    return response
+
+
 class ApplicationReportMixin:
     def do_REPORT(self, environ, base_prefix, path, user):
         access = app.Access(self._rights, user, path)
@@ -229,7 +279,8 @@ class ApplicationReportMixin:
             logger.debug("Client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
         with contextlib.ExitStack() as lock_stack:
-            lock_stack.enter_context(self._storage.acquire_lock("r", user))
+            lock_stack.enter_context(
+                self._storage.acquire_lock("r", user, [path]))
             item = next(self._storage.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
@@ -241,11 +292,20 @@ class ApplicationReportMixin:
                 collection = item.collection
             headers = {"Content-Type": "text/xml; charset=%s" % self._encoding}
             try:
-                status, xml_answer = xml_report(
+                status, xml_answer, xml_responses = xml_report(
                     base_prefix, path, xml_content, collection, self._encoding,
-                    lock_stack.close)
+                    lock_stack.close,
+                    self.configuration.get("storage", "max_sync_results"))
+                # Generate the first response before the answer is started,
+                # invalid filters are usually detected there
+                xml_responses = iter(xml_responses)
+                first_response = next(xml_responses, None)
             except ValueError as e:
                 logger.warning(
                     "Bad REPORT request on %r: %s", path, e, exc_info=True)
                 return httputils.BAD_REQUEST
-            return status, headers, self._xml_response(xml_answer)
+            if first_response is not None:
+                xml_responses = itertools.chain(
+                    (first_response,), xml_responses)
+            return status, headers, self._xml_response_chunks(
+                xml_answer, xml_responses)
@@ -0,0 +1,448 @@
+"""
+Serve the application from an asyncio event loop.
+
+Every connection is handled by a coroutine, so idle persistent connections
+don't tie up a thread. Requests are passed to the WSGI application in a
+thread pool, because storage access is blocking.
+
+"""
+
+import asyncio
+import contextlib
+import functools
+import http.client
+import io
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+from wsgiref.handlers import format_date_time
+
+from CDserver import VERSION, Application, httputils
+from CDserver.log import logger
+
+MAX_LINE_SIZE = 65536
+MAX_HEADERS = 100
+SERVER_SOFTWARE = "CDserver/%s" % VERSION
+
+
+class BadRequestError(ValueError):
+    def __init__(self, status, message):
+        self.status = status
+        super().__init__(message)
+
+
+class RequestBody(io.RawIOBase):
+    """Body of a single request that is read by the application.
+
+    The application reads the body in a worker thread, the data is read
+    from the connection by the event loop when it's requested (see
+    ``httputils.RequestBodyParser``).
+
+    """
+
+    def __init__(self, handler, length=None):
+        super().__init__()
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+        self._parser = httputils.RequestBodyParser(length)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(self._parser.read(len(buffer))), self._loop)
+        try:
+            data = future.result()
+        except asyncio.TimeoutError as e:
+            raise socket.timeout("Client timed out") from e
+        buffer[:len(data)] = data
+        return len(data)
+
+    async def _run(self, reads):
+        try:
+            size = next(reads)
+            while True:
+                if size is None:
+                    try:
+                        data = await self._handler._readline()
+                    except BadRequestError as e:
+                        raise RuntimeError(str(e)) from e
+                else:
+                    data = await self._handler._read(size)
+                size = reads.send(data)
+        except StopIteration as e:
+            return e.value
+
+    async def drain(self, max_size):
+        """Discard the rest of the body.
+
+        Returns ``False`` if more than ``max_size`` bytes are left or the
+        body is malformed.
+
+        """
+        try:
+            return await self._run(self._parser.drain(max_size))
+        except (OSError, RuntimeError, asyncio.TimeoutError):
+            return False
+
+
+class ConnectionHandler:
+    """Serve the requests of one client connection.
+
+    ``server_name`` is the name of the listening socket.
+
+    """
+
+    def __init__(self, server, reader, writer, server_name):
+        self._server = server
+        self._configuration = server.configuration
+        self._reader = reader
+        self._writer = writer
+        sockname = writer.get_extra_info("sockname")
+        peername = writer.get_extra_info("peername")
+        self._base_environ = {
+            "SERVER_NAME": server_name,
+            "SERVER_PORT": str(sockname[1]),
+            "GATEWAY_INTERFACE": "CGI/1.1",
+            "SCRIPT_NAME": "",
+            "REMOTE_HOST": "",
+            "REMOTE_ADDR": peername[0] if peername else "",
+            "SERVER_SOFTWARE": SERVER_SOFTWARE,
+            "wsgi.errors": sys.stderr,
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False}
+        self._timeout = self._configuration.get("server", "timeout") or None
+        self.idle = True
+
+    def close(self):
+        # Don't wait for the TLS shutdown of idle connections
+        self._writer.transport.abort()
+
+    async def _readline(self):
+        try:
+            line = await asyncio.wait_for(
+                self._reader.readuntil(b"\n"), self._timeout)
+        except asyncio.IncompleteReadError as e:
+            line = e.partial
+        except asyncio.LimitOverrunError as e:
+            raise BadRequestError(431, "Line too long") from e
+        if len(line) > MAX_LINE_SIZE:
+            raise BadRequestError(431, "Line too long")
+        return line
+
+    async def _read(self, size):
+        return await asyncio.wait_for(self._reader.read(size), self._timeout)
+
+    async def _drain(self):
+        await asyncio.wait_for(self._writer.drain(), self._timeout)
+
+    async def handle(self):
+        try:
+            while not self._server.closing:
+                self.idle = True
+                try:
+                    request_line = await self._readline()
+                except asyncio.TimeoutError:
+                    # Idle persistent connection
+                    break
+                finally:
+                    self.idle = False
+                if not request_line:
+                    break
+                try:
+                    keep_alive = await self._handle_request(request_line)
+                except BadRequestError as e:
+                    logger.info("Bad request: %s", e)
+                    await self._send_error(e.status)
+                    break
+                except asyncio.TimeoutError:
+                    logger.info("Client timed out")
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, OSError) as e:
+            logger.debug("Connection error: %s", e, exc_info=True)
+        except Exception as e:
+            logger.error("An exception occurred during request: %s", e,
+                         exc_info=True)
+        finally:
+            self._writer.close()
+            with contextlib.suppress(Exception):
+                await self._writer.wait_closed()
+
+    async def _read_headers(self):
+        lines = []
+        while True:
+            line = await self._readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(lines) >= MAX_HEADERS:
+                raise BadRequestError(431, "Too many headers")
+            lines.append(line)
+        return http.client.parse_headers(
+            io.BytesIO(b"".join(lines) + b"\r\n"))
+
+    def _get_request_body(self, headers):
+        transfer_encoding = headers.get("Transfer-Encoding", "")
+        if transfer_encoding:
+            if transfer_encoding.strip().lower() != "chunked":
+                raise BadRequestError(501, "Unsupported transfer encoding")
+            # The length is given by the chunked transfer coding
+            return RequestBody(self), None
+        try:
+            content_length = int(headers.get("Content-Length") or 0)
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            raise BadRequestError(400, "Invalid Content-Length")
+        max_content_length = self._configuration.get(
+            "server", "max_content_length")
+        if max_content_length and content_length > max_content_length:
+            raise BadRequestError(413, "Request body too large")
+        return RequestBody(self, content_length), content_length
+
+    def _get_environ(self, method, target, version, headers, body,
+                     content_length):
+        environ = self._base_environ.copy()
+        path, _, query = target.partition("?")
+        environ["REQUEST_METHOD"] = method
+        environ["SERVER_PROTOCOL"] = version
+        environ["PATH_INFO"] = unquote(path)
+        environ["QUERY_STRING"] = query
+        environ["CONTENT_TYPE"] = headers.get(
+            "Content-Type", headers.get_content_type())
+        if content_length is None:
+            environ["wsgi.input_terminated"] = True
+        else:
+            environ["CONTENT_LENGTH"] = str(content_length)
+        environ["wsgi.input"] = body
+        for key, value in headers.items():
+            key = key.replace("-", "_").upper()
+            value = value.strip()
+            if key in environ or key in ("CONTENT_LENGTH",
+                                         "TRANSFER_ENCODING"):
+                continue
+            if "HTTP_" + key in environ:
+                environ["HTTP_" + key] += "," + value
+            else:
+                environ["HTTP_" + key] = value
+        if self._writer.get_extra_info("sslcontext"):
+            environ["HTTPS"] = "on"
+            environ["wsgi.url_scheme"] = "https"
+            environ["REMOTE_CERTIFICATE"] = self._writer.get_extra_info(
+                "peercert")
+        return environ
+
+    async def _handle_request(self, request_line):
+        try:
+            method, target, version = request_line.decode(
+                "iso-8859-1").split()
+        except ValueError as e:
+            raise BadRequestError(400, "Bad request line: %r" %
+                                  request_line) from e
+        if version not in ("HTTP/1.0", "HTTP/1.1"):
+            raise BadRequestError(505, "Unsupported HTTP version: %r" %
+                                  version)
+        headers = await self._read_headers()
+        connection = headers.get("Connection", "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+        if headers.get("Expect", "").lower() == "100-continue":
+            self._writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        body, content_length = self._get_request_body(headers)
+        environ = self._get_environ(method, target, version, headers, body,
+                                    content_length)
+        keep_alive = await self._send_response(environ, keep_alive)
+        if keep_alive and not await body.drain(httputils.MAX_DRAIN_SIZE):
+            keep_alive = False
+        return keep_alive
+
+    async def _send_response(self, environ, keep_alive):
+        loop = asyncio.get_running_loop()
+        executor = self._server.executor
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = status
+            response["headers"] = headers
+
+        def run_application():
+            answers = self._server.application(environ, start_response)
+            return iter(answers), answers
+
+        answers_iter, answers = await loop.run_in_executor(
+            executor, run_application)
+        try:
+            status = response["status"]
+            headers = list(response["headers"])
+            header_names = {key.lower() for key, _ in headers}
+            version = environ["SERVER_PROTOCOL"]
+            has_body = (environ["REQUEST_METHOD"] != "HEAD" and
+                        status[:3] not in ("204", "304") and
+                        not status.startswith("1"))
+            chunked = False
+            if "content-length" not in header_names:
+                if not has_body:
+                    headers.append(("Content-Length", "0"))
+                elif version == "HTTP/1.1":
+                    headers.append(("Transfer-Encoding", "chunked"))
+                    chunked = True
+                else:
+                    keep_alive = False
+            if self._server.closing:
+                keep_alive = False
+            if not keep_alive:
+                headers.append(("Connection", "close"))
+            elif version == "HTTP/1.0":
+                headers.append(("Connection", "keep-alive"))
+            if "date" not in header_names:
+                headers.append(("Date", format_date_time(time.time())))
+            if "server" not in header_names:
+                headers.append(("Server", SERVER_SOFTWARE))
+            self._writer.write(("HTTP/1.1 %s\r\n%s\r\n" % (status, "".join(
+                "%s: %s\r\n" % header for header in headers))).encode(
+                    "iso-8859-1"))
+            while True:
+                data = await loop.run_in_executor(
+                    executor, next, answers_iter, None)
+                if data is None:
+                    break
+                if not data or not has_body:
+                    continue
+                if chunked:
+                    self._writer.write(b"%x\r\n" % len(data))
+                    self._writer.write(data)
+                    self._writer.write(b"\r\n")
+                else:
+                    self._writer.write(data)
+                await self._drain()
+            if chunked:
+                self._writer.write(b"0\r\n\r\n")
+            await self._drain()
+        finally:
+            if hasattr(answers, "close"):
+                await loop.run_in_executor(executor, answers.close)
+        return keep_alive
+
+    async def _send_error(self, status):
+        message = http.client.responses.get(status, "Error")
+        body = message.encode("ascii")
+        with contextlib.suppress(ConnectionError, OSError):
+            self._writer.write((
+                "HTTP/1.1 %d %s\r\nContent-Type: text/plain\r\n"
+                "Content-Length: %d\r\nConnection: close\r\n\r\n" % (
+                    status, message, len(body))).encode("ascii") + body)
+            await self._drain()
+
+
+class AsyncServer:
+
+    def __init__(self, configuration, application, ssl_context_loader=None):
+        self.configuration = configuration
+        self.application = application
+        self.ssl_context_loader = ssl_context_loader
+        self.executor = ThreadPoolExecutor(
+            configuration.get("server", "workers"),
+            thread_name_prefix="Worker")
+        self.closing = False
+        self._handlers = set()
+
+    async def _check_certificate(self):
+        while True:
+            await asyncio.sleep(self.ssl_context_loader.check_interval)
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.ssl_context_loader.check)
+
+    async def _client_connected(self, server_name, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET,
+                                                socket.AF_INET6):
+            # asyncio disables Nagle's algorithm for all TCP connections
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(
+                self.configuration.get("server", "tcp_nodelay")))
+        handler = ConnectionHandler(self, reader, writer, server_name)
+        self._handlers.add(handler)
+        try:
+            await handler.handle()
+        finally:
+            self._handlers.discard(handler)
+
+    async def serve(self, shutdown_socket=None, sockets=None):
+        loop = asyncio.get_running_loop()
+        servers = []
+        check_task = None
+        kwargs = dict(backlog=self.configuration.get("server", "backlog"),
+                      limit=MAX_LINE_SIZE + 1)
+        if self.ssl_context_loader:
+            kwargs["ssl"] = self.ssl_context_loader.context
+            kwargs["ssl_handshake_timeout"] = (
+                self.configuration.get("server", "timeout") or None)
+        try:
+            if sockets is not None:
+                # Listening sockets inherited from the supervisor
+                for sock in sockets:
+                    # Looked up once per listening socket like wsgiref does,
+                    # not for every connection on the event loop
+                    server_name = socket.getfqdn(sock.getsockname()[0])
+                    servers.append(await asyncio.start_server(
+                        functools.partial(self._client_connected,
+                                          server_name),
+                        sock=sock, **kwargs))
+            else:
+                for address in self.configuration.get("server", "hosts"):
+                    server_name = socket.getfqdn(address[0])
+                    try:
+                        servers.append(await asyncio.start_server(
+                            functools.partial(self._client_connected,
+                                              server_name),
+                            address[0], address[1], **kwargs))
+                    except OSError as e:
+                        raise RuntimeError(
+                            "Failed to start server %r: %s" % (
+                                "[%s]:%d" % address, e)) from e
+            for server in servers:
+                for sock in server.sockets:
+                    logger.info("Listening on %r",
+                                "[%s]:%d" % sock.getsockname()[:2])
+            if not servers:
+                raise RuntimeError("No servers started")
+            if self.ssl_context_loader:
+                check_task = loop.create_task(self._check_certificate())
+            logger.info("CDserver server is ready")
+            if shutdown_socket is None:
+                await asyncio.Event().wait()
+            else:
+                shutdown_socket.setblocking(False)
+                await loop.sock_recv(shutdown_socket, 1)
+            logger.info("Stopping CDserver")
+        finally:
+            self.closing = True
+            if check_task:
+                check_task.cancel()
+            for server in servers:
+                server.close()
+            for server in servers:
+                await server.wait_closed()
+            # Wait for active requests, drop idle connections
+            while self._handlers:
+                for handler in list(self._handlers):
+                    if handler.idle:
+                        handler.close()
+                await asyncio.sleep(0.05)
+            self.executor.shutdown()
+
+
+def serve(configuration, shutdown_socket=None, application=None,
+          sockets=None, ssl_context_loader=None):
+    if application is None:
+        application = Application(configuration)
+    server = AsyncServer(configuration, application, ssl_context_loader)
+    asyncio.run(server.serve(shutdown_socket, sockets))
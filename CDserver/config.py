@@ -32,6 +32,25 @@ def logging_level(value):
     return value
 
 
+def compression_level(value):
+    value = int(value)
+    if not 0 <= value <= 9:
+        raise ValueError("unsupported level: %d" % value)
+    return value
+
+
+def item_cache_validation(value):
+    if value not in ("stat", "hash"):
+        raise ValueError("unsupported validation: %r" % value)
+    return value
+
+
+def filesystem_sync(value):
+    if value not in ("always", "request", "group"):
+        raise ValueError("unsupported mode: %r" % value)
+    return value
+
+
 def filepath(value):
     if not value:
         return ""
@@ -75,14 +94,47 @@ DEFAULT_CONFIG_SCHEMA = OrderedDict([
             "help": "set server hostnames including ports",
             "aliases": ("-H", "--hosts",),
             "type": list_of_ip_address}),
+        ("workers", {
+            "value": "8",
+            "help": "number of worker threads serving connections",
+            "type": positive_int}),
+        ("processes", {
+            "value": "1",
+            "help": "number of worker processes sharing the listening sockets",
+            "type": positive_int}),
+        ("backlog", {
+            "value": "64",
+            "help": "maximum number of pending connections",
+            "type": positive_int}),
+        ("asyncio", {
+            "value": "False",
+            "help": "serve connections from an asyncio event loop",
+            "type": bool}),
+        ("tcp_nodelay", {
+            "value": "True",
+            "help": "disable Nagle's algorithm on client sockets",
+            "type": bool}),
         ("max_content_length", {
             "value": "100000000",
             "help": "maximum size of request body in bytes",
             "type": positive_int}),
+        ("compression_level", {
+            "value": "6",
+            "help": "compression level of responses (0 disables compression)",
+            "type": compression_level}),
+        ("compression_min_size", {
+            "value": "1024",
+            "help": "minimum size of responses in bytes that are compressed",
+            "type": positive_int}),
         ("timeout", {
             "value": "30",
             "help": "socket timeout",
             "type": positive_float}),
+        ("ssl", {
+            "value": "False",
+            "help": "use SSL connection",
+            "aliases": ("-s", "--ssl",),
+            "type": bool}),
         ("certificate", {
             "value": "/etc/ssl/CDserver.cert.pem",
             "help": "set certificate file",
@@ -157,10 +209,66 @@ DEFAULT_CONFIG_SCHEMA = OrderedDict([
             "value": "2592000",  # 30 days
             "help": "delete sync token that are older",
             "type": positive_int}),
+        ("max_sync_results", {
+            "value": "0",
+            "help": "maximum number of changes in a response to a "
+                    "sync-collection request (0 for no limit)",
+            "type": positive_int}),
+        ("auto_provision", {
+            "value": "False",
+            "help": "create the collections of users on first access (only "
+                    "enable it with an authentication backend, otherwise "
+                    "every login creates collections)",
+            "type": bool}),
+        ("item_cache_validation", {
+            "value": "stat",
+            "help": "check cached items by file metadata (stat) or by the "
+                    "hash of their content (hash)",
+            "type": item_cache_validation}),
+        ("memory_cache_items", {
+            "value": "10000",
+            "help": "maximum number of items that are cached in memory "
+                    "(0 disables the cache)",
+            "type": positive_int}),
+        ("memory_cache_size", {
+            "value": "33554432",
+            "help": "maximum size of the items that are cached in memory "
+                    "in bytes",
+            "type": positive_int}),
+        ("memory_cache_text", {
+            "value": "True",
+            "help": "cache the text of items in memory",
+            "type": bool}),
+        ("memory_cache_collections", {
+            "value": "1000",
+            "help": "maximum number of collections whose indexes and "
+                    "properties are cached in memory (0 disables the cache)",
+            "type": positive_int}),
+        ("maintenance_interval", {
+            "value": "300",
+            "help": "seconds between runs of the background maintenance "
+                    "(0 disables the maintenance)",
+            "type": positive_int}),
+        ("maintenance_budget", {
+            "value": "100",
+            "help": "maximum number of collections that are checked in a "
+                    "run of the background maintenance",
+            "type": positive_int}),
         ("hook", {
             "value": "",
             "help": "command that is run after changes to storage",
             "type": str}),
+        ("hook_delay", {
+            "value": "1",
+            "help": "seconds to wait for more changes of a user before the "
+                    "hook is run",
+            "type": positive_float}),
+        ("filesystem_sync", {
+            "value": "always",
+            "help": "sync every change (always), sync the changed folders "
+                    "at the end of each request (request) or combine these "
+                    "syncs of concurrent requests (group)",
+            "type": filesystem_sync}),
         ("_filesystem_fsync", {
             "value": "True",
             "help": "sync all changes to filesystem during requests",
@@ -1,7 +1,28 @@
+import codecs
+import io
+import tempfile
+import zlib
 from http import client
 
 from CDserver.log import logger
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Supported content codings, in order of preference
+CONTENT_ENCODINGS = ("gzip", "deflate")
+if brotli is not None:
+    CONTENT_ENCODINGS = ("br",) + CONTENT_ENCODINGS
+# Supported content codings of request bodies
+REQUEST_CONTENT_ENCODINGS = ("", "identity", "gzip", "x-gzip", "deflate")
+CHUNK_SIZE = 65536
+SPOOL_SIZE = 1024 * 1024
+# Unread request bodies up to this size are skipped to keep the connection
+# open, larger ones close it
+MAX_DRAIN_SIZE = 65536
+
 NOT_ALLOWED = (
     client.FORBIDDEN, (("Content-Type", "text/plain"),),
     "Access to the requested resource is forbidden.")
@@ -34,6 +55,10 @@ REMOTE_DESTINATION = (
 DIRECTORY_LISTING = (
     client.FORBIDDEN, (("Content-Type", "text/plain"),),
     "Directory listings are not supported.")
+UNSUPPORTED_CONTENT_ENCODING = (
+    client.UNSUPPORTED_MEDIA_TYPE, (("Content-Type", "text/plain"),
+                                    ("Accept-Encoding", "gzip, deflate")),
+    "Unsupported content encoding of request body.")
 INTERNAL_SERVER_ERROR = (
     client.INTERNAL_SERVER_ERROR, (("Content-Type", "text/plain"),),
     "A server error occurred.  Please contact the administrator.")
@@ -41,7 +66,74 @@ INTERNAL_SERVER_ERROR = (
 DAV_HEADERS = "1, 2, 3, calendar-access, addressbook, extended-mkcol"
 
 
-def decode_request(configuration, environ, text):
+class RequestBodyParser:
+    """Body of a single request on a persistent connection, without I/O.
+
+    Reads are limited to ``Content-Length`` or decoded from the chunked
+    transfer coding, so that the following request is never consumed.
+    ``read`` and ``drain`` are generators that yield the number of bytes
+    to read from the connection (``None`` for a line) and expect the data
+    to be sent back.
+
+    """
+
+    def __init__(self, length=None):
+        self._length = length
+        self._chunk_length = 0
+        self.eof = length == 0
+
+    def read(self, size):
+        if self.eof or not size:
+            return b""
+        if self._length is not None:
+            data = yield min(size, self._length)
+            if not data:
+                raise RuntimeError("Request body too short")
+            self._length -= len(data)
+            self.eof = not self._length
+            return data
+        if not self._chunk_length:
+            yield from self._read_chunk_header()
+            if self.eof:
+                return b""
+        data = yield min(size, self._chunk_length)
+        if not data:
+            raise RuntimeError("Incomplete chunk in request body")
+        self._chunk_length -= len(data)
+        if not self._chunk_length:
+            yield None
+        return data
+
+    def _read_chunk_header(self):
+        line = yield None
+        try:
+            self._chunk_length = int(line.split(b";", 1)[0].strip(), 16)
+        except ValueError as e:
+            raise RuntimeError("Malformed chunk size: %r" % line) from e
+        if self._chunk_length < 0:
+            raise RuntimeError("Malformed chunk size: %r" % line)
+        if not self._chunk_length:
+            # Skip trailers
+            while (yield None) not in (b"\r\n", b"\n", b""):
+                pass
+            self.eof = True
+
+    def drain(self, max_size):
+        """Discard the rest of the body.
+
+        Returns ``False`` if more than ``max_size`` bytes are left.
+
+        """
+        while not self.eof:
+            if self._length is not None and self._length > max_size:
+                return False
+            max_size -= len((yield from self.read(CHUNK_SIZE)))
+            if max_size < 0:
+                return False
+        return True
+
+
+def _request_charsets(configuration, environ):
     charsets = []
 
     content_type = environ.get("CONTENT_TYPE")
@@ -54,7 +146,11 @@ def decode_request(configuration, environ, text):
     for i, s in reversed(list(enumerate(charsets))):
         if s in charsets[:i]:
             del charsets[i]
+    return charsets
+
 
+def decode_request(configuration, environ, text):
+    charsets = _request_charsets(configuration, environ)
     for charset in charsets:
         try:
             return text.decode(charset)
@@ -64,14 +160,107 @@ def decode_request(configuration, environ, text):
                              "all codecs failed [%s]" % ", ".join(charsets))
 
 
-def read_raw_request_body(configuration, environ):
+def decode_request_stream(configuration, environ, body):
+    """Get a text stream for the binary file ``body``.
+
+    The charsets are tried in the same order as by ``decode_request``.
+    ``body`` is only read in chunks of ``CHUNK_SIZE`` bytes.
+
+    """
+    charsets = _request_charsets(configuration, environ)
+    for charset in charsets:
+        decoder = codecs.getincrementaldecoder(charset)()
+        body.seek(0)
+        try:
+            while True:
+                chunk = body.read(CHUNK_SIZE)
+                decoder.decode(chunk, final=not chunk)
+                if not chunk:
+                    break
+        except UnicodeDecodeError:
+            continue
+        body.seek(0)
+        return io.TextIOWrapper(body, encoding=charset, newline="")
+    raise UnicodeDecodeError("decode_request_stream", b"", 0, 0,
+                             "all codecs failed [%s]" % ", ".join(charsets))
+
+
+def _iter_encoded_request_body(configuration, environ):
     content_length = int(environ.get("CONTENT_LENGTH") or 0)
-    if not content_length:
-        return b""
-    content = environ["wsgi.input"].read(content_length)
-    if len(content) < content_length:
-        raise RuntimeError("Request body too short: %d" % len(content))
-    return content
+    if not content_length and environ.get("wsgi.input_terminated"):
+        # Body without known length (e.g. chunked transfer coding)
+        max_content_length = configuration.get("server", "max_content_length")
+        size = 0
+        while True:
+            chunk = environ["wsgi.input"].read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_content_length and size > max_content_length:
+                raise RuntimeError("Request body too large: %d" % size)
+            yield chunk
+        return
+    size = 0
+    while size < content_length:
+        chunk = environ["wsgi.input"].read(
+            min(CHUNK_SIZE, content_length - size))
+        if not chunk:
+            raise RuntimeError("Request body too short: %d" % size)
+        size += len(chunk)
+        yield chunk
+
+
+def get_request_content_encoding(environ):
+    return environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+
+
+def iter_raw_request_body(configuration, environ):
+    """Read the request body in chunks of up to ``CHUNK_SIZE`` bytes.
+
+    Bodies with a ``Content-Encoding`` are decompressed. The maximum content
+    length is enforced on the decompressed size.
+
+    """
+    content_encoding = get_request_content_encoding(environ)
+    chunks = _iter_encoded_request_body(configuration, environ)
+    if content_encoding in ("", "identity"):
+        yield from chunks
+        return
+    if content_encoding in ("gzip", "x-gzip"):
+        wbits = 16 + zlib.MAX_WBITS
+    elif content_encoding == "deflate":
+        wbits = zlib.MAX_WBITS
+    else:
+        raise RuntimeError("Unsupported content encoding: %r" %
+                           content_encoding)
+    max_content_length = configuration.get("server", "max_content_length")
+    decompressor = zlib.decompressobj(wbits)
+    size = 0
+    try:
+        for data in chunks:
+            while data:
+                # Limit the output, a small chunk can expand to gigabytes
+                chunk = decompressor.decompress(data, CHUNK_SIZE)
+                data = decompressor.unconsumed_tail
+                if decompressor.eof and decompressor.unused_data:
+                    # Concatenated gzip members
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits)
+                size += len(chunk)
+                if max_content_length and size > max_content_length:
+                    raise RuntimeError(
+                        "Decompressed request body too large: %d" % size)
+                if chunk:
+                    yield chunk
+        if not decompressor.eof:
+            raise RuntimeError("Compressed request body is truncated")
+    except zlib.error as e:
+        raise RuntimeError(
+            "Failed to decompress request body: %s" % e) from e
+
+
+def read_raw_request_body(configuration, environ):
+    return b"".join(iter_raw_request_body(configuration, environ))
 
 
 def read_request_body(configuration, environ):
@@ -79,3 +268,121 @@ def read_request_body(configuration, environ):
         configuration, environ, read_raw_request_body(configuration, environ))
     logger.debug("Request content:\n%s", content)
     return content
+
+
+def spool_request_body(configuration, environ):
+    """Read the request body into a temporary file.
+
+    Bodies larger than ``SPOOL_SIZE`` bytes are written to disk. The
+    returned binary file is positioned at the start.
+
+    """
+    # ``tempfile.SpooledTemporaryFile`` can't be wrapped in
+    # ``io.TextIOWrapper`` before Python 3.11
+    body = io.BytesIO()
+    try:
+        for chunk in iter_raw_request_body(configuration, environ):
+            if (isinstance(body, io.BytesIO) and
+                    body.tell() + len(chunk) > SPOOL_SIZE):
+                spooled_body = body
+                body = tempfile.TemporaryFile()
+                body.write(spooled_body.getbuffer())
+            body.write(chunk)
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+    return body
+
+
+def buffer_chunks(chunks, encoding, size=CHUNK_SIZE):
+    """Encode ``chunks`` and join them into blocks of about ``size`` bytes.
+
+    All blocks but the last one are at least ``size`` bytes long.
+
+    """
+    buffer = []
+    buffer_size = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode(encoding, "xmlcharrefreplace")
+        buffer.append(chunk)
+        buffer_size += len(chunk)
+        if buffer_size >= size:
+            yield b"".join(buffer)
+            buffer.clear()
+            buffer_size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def select_content_encoding(accept_encoding):
+    """Select the preferred content coding from an Accept-Encoding header.
+
+    Returns ``None`` if the answer should not be compressed.
+
+    """
+    qvalues = {}
+    for coding in accept_encoding.split(","):
+        coding, *params = coding.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        qvalue = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[coding] = qvalue
+    wildcard_qvalue = qvalues.get("*", 0.0)
+    best_coding = None
+    best_qvalue = 0.0
+    for coding in CONTENT_ENCODINGS:
+        qvalue = qvalues.get(coding, wildcard_qvalue)
+        if qvalue > best_qvalue:
+            best_coding, best_qvalue = coding, qvalue
+    return best_coding
+
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def compressobj(content_encoding, level):
+    """Get a compressor for ``content_encoding``.
+
+    The compressor has the ``compress`` and ``flush`` methods of
+    ``zlib.compressobj``. For brotli ``level`` is used as the quality.
+
+    """
+    if content_encoding == "br":
+        return _BrotliCompressor(level)
+    if content_encoding == "gzip":
+        return zlib.compressobj(level, wbits=16 + zlib.MAX_WBITS)
+    if content_encoding == "deflate":
+        return zlib.compressobj(level)
+    raise ValueError("Unsupported content encoding: %r" % content_encoding)
+
+
+def compress(data, content_encoding, level):
+    compressor = compressobj(content_encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_chunks(chunks, content_encoding, level):
+    compressor = compressobj(content_encoding, level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -32,7 +32,33 @@ def predict_tag_of_whole_collection(vobject_items, fallback_tag=None):
     return fallback_tag
 
 
-def check_and_sanitize_items(vobject_items, is_collection=False, tag=None):
+def read_components(stream):
+    """Parse the components of the text ``stream`` one at a time.
+
+    Only the text of the current top-level component is kept in memory.
+
+    """
+    lines = []
+    depth = 0
+    for line in stream:
+        lines.append(line)
+        name = line[:6].upper()
+        if name.startswith("BEGIN:"):
+            depth += 1
+        elif name.startswith("END:"):
+            depth -= 1
+            if depth <= 0:
+                text = "".join(lines)
+                lines.clear()
+                depth = 0
+                yield from vobject.readComponents(text)
+    text = "".join(lines)
+    if text.strip():
+        yield from vobject.readComponents(text)
+
+
+def check_and_sanitize_items(vobject_items, is_collection=False, tag=None,
+                             uids=None):
     if tag and tag not in ("VCALENDAR", "VADDRESSBOOK"):
         raise ValueError("Unsupported collection tag: %r" % tag)
     if not is_collection and len(vobject_items) != 1:
@@ -98,7 +124,8 @@ def check_and_sanitize_items(vobject_items, is_collection=False, tag=None):
                 raise ValueError("Invalid recurrence rules in %s in object %r"
                                  % (component.name, component_uid)) from e
     elif tag == "VADDRESSBOOK":
-        object_uids = set()
+        # ``uids`` is shared by components that are checked separately
+        object_uids = set() if uids is None else uids
         for vobject_item in vobject_items:
             if vobject_item.name == "VCARD":
                 object_uid = get_uid(vobject_item)
@@ -229,10 +256,10 @@ class Item:
     def __init__(self, collection_path=None, collection=None,
                  vobject_item=None, href=None, last_modified=None, text=None,
                  etag=None, uid=None, name=None, component_name=None,
-                 time_range=None):
-        if text is None and vobject_item is None:
-            raise ValueError(
-                "At least one of 'text' or 'vobject_item' must be set")
+                 time_range=None, load_text=None):
+        if text is None and vobject_item is None and load_text is None:
+            raise ValueError("At least one of 'text', 'vobject_item' or "
+                             "'load_text' must be set")
         if collection_path is None:
             if collection is None:
                 raise ValueError("At least one of 'collection_path' or "
@@ -245,6 +272,7 @@ class Item:
         self.href = href
         self.last_modified = last_modified
         self._text = text
+        self._load_text = load_text
         self._vobject_item = vobject_item
         self._etag = etag
         self._uid = uid
@@ -253,6 +281,13 @@ class Item:
         self._time_range = time_range
 
     def serialize(self):
+        if self._text is None and self._load_text is not None:
+            try:
+                self._text = self._load_text()
+            except Exception as e:
+                raise RuntimeError("Failed to load item %r from %r: %s" %
+                                   (self.href, self._collection_path,
+                                    e)) from e
         if self._text is None:
             try:
                 self._text = self.vobject_item.serialize()
@@ -265,8 +300,9 @@ class Item:
     @property
     def vobject_item(self):
         if self._vobject_item is None:
+            text = self.serialize()
             try:
-                self._vobject_item = vobject.readOne(self._text)
+                self._vobject_item = vobject.readOne(text)
             except Exception as e:
                 raise RuntimeError("Failed to parse item %r from %r: %s" %
                                    (self.href, self._collection_path,
@@ -304,9 +340,14 @@ class Item:
                 find_tag_and_time_range(self.vobject_item))
         return self._time_range
 
-    def prepare(self):
-        """Fill cache with values."""
-        orig_vobject_item = self._vobject_item
+    def prepare(self, keep_vobject_item=True):
+        """Fill cache with values.
+
+        The parsed ``vobject_item`` is dropped if ``keep_vobject_item`` is
+        not set, it's parsed again from the text when it's needed.
+
+        """
+        orig_vobject_item = self._vobject_item if keep_vobject_item else None
         self.serialize()
         self.etag
         self.uid
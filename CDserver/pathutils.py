@@ -3,6 +3,7 @@ import os
 import posixpath
 import sys
 import threading
+import weakref
 from tempfile import TemporaryDirectory
 from CDserver.log import logger
 
@@ -24,17 +25,51 @@ else:
         ctypes.c_uint]
     renameat2.restype = ctypes.c_int
 
+HAVE_SYNCFS = False
+try:
+    _syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+except AttributeError:
+    pass
+else:
+    HAVE_SYNCFS = True
+    _syncfs.argtypes = [ctypes.c_int]
+    _syncfs.restype = ctypes.c_int
+
 
 class RwLock:
-    def __init__(self, path):
+    """Readers-writer lock for the threads and processes of the server.
+
+    The lock file is locked when the first thread of the process acquires
+    the lock and unlocked when the last thread releases it. It's opened once
+    per process, unless ``keep_open`` is false. Then it's closed when it's
+    released, so it can be replaced (e.g. with its folder) between uses.
+
+    """
+
+    def __init__(self, path, keep_open=True):
         self._path = path
+        self._keep_open = keep_open
+        self._reset()
+        _rw_locks.add(self)
+
+    def _reset(self):
         self._readers = 0
         self._writer = False
-        self._lock = threading.Lock()
+        self._acquiring = False
+        self._lock_fd = None
+        self._condition = threading.Condition()
+
+    def _reset_after_fork(self):
+        # The file of the parent process is shared with the child process,
+        # so are its locks. The file descriptor is closed directly, file
+        # objects could be locked by other threads of the parent process.
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+        self._reset()
 
     @property
     def locked(self):
-        with self._lock:
+        with self._condition:
             if self._readers > 0:
                 return "r"
             if self._writer:
@@ -45,22 +80,67 @@ class RwLock:
     def acquire(self, mode):
         if mode not in "rw":
             raise ValueError("Invalid mode: %r" % mode)
-        with open(self._path, "w+") as lock_file:
-            _cmd = fcntl.LOCK_EX if mode == "w" else fcntl.LOCK_SH
-            fcntl.flock(lock_file.fileno(), _cmd)
-
-            with self._lock:
+        with self._condition:
+            while (self._writer or self._acquiring or
+                   mode == "w" and self._readers > 0):
+                self._condition.wait()
+            lock_file = self._readers == 0
+            if lock_file:
+                self._acquiring = True
+            else:
+                self._readers += 1
+        if lock_file:
+            try:
+                if self._lock_fd is None:
+                    self._lock_fd = os.open(
+                        self._path, os.O_RDWR | os.O_CREAT, 0o666)
+                try:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX
+                                if mode == "w" else fcntl.LOCK_SH)
+                except BaseException:
+                    if not self._keep_open:
+                        os.close(self._lock_fd)
+                        self._lock_fd = None
+                    raise
+            except BaseException:
+                with self._condition:
+                    self._acquiring = False
+                    self._condition.notify_all()
+                raise
+            with self._condition:
+                self._acquiring = False
                 if mode == "r":
                     self._readers += 1
                 else:
                     self._writer = True
-            try:
-                yield
-            finally:
-                with self._lock:
-                    if mode == "r":
-                        self._readers -= 1
+                self._condition.notify_all()
+        try:
+            yield
+        finally:
+            with self._condition:
+                if mode == "r":
+                    self._readers -= 1
+                else:
                     self._writer = False
+                if self._readers == 0 and not self._writer:
+                    if self._keep_open:
+                        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                    else:
+                        # Closing the file releases the lock
+                        os.close(self._lock_fd)
+                        self._lock_fd = None
+                    self._condition.notify_all()
+
+
+_rw_locks = weakref.WeakSet()
+
+
+def _reset_rw_locks_after_fork():
+    for lock in list(_rw_locks):
+        lock._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_rw_locks_after_fork)
 
 
 def rename_exchange(src, dst):
@@ -101,6 +181,17 @@ def fsync(fd):
         os.fsync(fd)
 
 
+def syncfs(path):
+    """Sync the filesystem that contains ``path``."""
+    fd = os.open(path, 0)
+    try:
+        if _syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+    finally:
+        os.close(fd)
+
+
 def strip_path(path):
     assert sanitize_path(path) == path
     return path.strip("/")
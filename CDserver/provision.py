@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+from CDserver import pathutils
+from CDserver.log import logger
+
+DEFAULT_ADDRESSBOOK = "contacts"
+DEFAULT_ADDRESSBOOK_PROPS = {
+    "CR:addressbook-description": "description",
+    "D:displayname": "contacts",
+    "tag": "VADDRESSBOOK",
+    "{http://inf-it.com/ns/ab/}addressbook-color": "#9b9eb4ff"}
+
+# Number of provisioned users that are remembered
+MAX_PROVISIONED_USERS = 1024
+
+
+class Provisioner:
+    """Create the principal collection and default address book of users.
+
+    Recently provisioned users are remembered, so only their first access
+    touches the storage.
+
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._provisioned = OrderedDict()
+        self._provisioned_lock = threading.Lock()
+
+    def _is_provisioned(self, user):
+        with self._provisioned_lock:
+            if user not in self._provisioned:
+                return False
+            self._provisioned.move_to_end(user)
+            return True
+
+    def _remember(self, user):
+        with self._provisioned_lock:
+            self._provisioned[user] = None
+            while len(self._provisioned) > MAX_PROVISIONED_USERS:
+                self._provisioned.popitem(last=False)
+
+    def _find_missing(self, user):
+        principal_path = pathutils.unstrip_path(user, True)
+        addressbook_path = pathutils.unstrip_path(
+            "%s/%s" % (user, DEFAULT_ADDRESSBOOK), True)
+        missing = []
+        for path, props in ((principal_path, None),
+                            (addressbook_path, DEFAULT_ADDRESSBOOK_PROPS)):
+            if next(self._storage.discover(path), None) is None:
+                missing.append((path, props))
+        return missing
+
+    def provision(self, user):
+        if not user or self._is_provisioned(user):
+            return
+        if not pathutils.is_safe_filesystem_path_component(user):
+            logger.warning("Can't create collections for user %r", user)
+            return
+        paths = [pathutils.unstrip_path(user, True)]
+        with self._storage.acquire_lock("r", user, paths):
+            missing = self._find_missing(user)
+        if missing:
+            with self._storage.acquire_lock("w", user, paths):
+                for path, props in self._find_missing(user):
+                    logger.info("Creating collection %r for user %r",
+                                path, user)
+                    self._storage.create_collection(
+                        path, props=dict(props) if props else None)
+        self._remember(user)
@@ -1,13 +1,19 @@
+import contextlib
 import errno
+import io
 import os
-import select
+import queue
+import selectors
+import signal
 import socket
-import socketserver
+import ssl
 import sys
+import threading
+import time
 import wsgiref.simple_server
 from urllib.parse import unquote
 
-from CDserver import Application, config
+from CDserver import Application, asyncserver, config, httputils
 from CDserver.log import logger
 
 if hasattr(socket, "EAI_ADDRFAMILY"):
@@ -26,17 +32,160 @@ def format_address(address):
     return "[%s]:%d" % address[:2]
 
 
-class ParallelHTTPServer(socketserver.ThreadingMixIn,
-                         wsgiref.simple_server.WSGIServer):
+class SSLContextLoader:
+    """Server SSL context that picks up renewed certificates.
 
-    block_on_close = False
-    daemon_threads = True
+    The same context is used for all connections and inherited by forked
+    workers, so clients can resume their TLS sessions with session tickets
+    or the session cache of any worker. The servers check the certificate
+    files for changes every ``check_interval`` seconds, outside of the
+    accept loop. Changed files are loaded into the existing context, which
+    keeps the session ticket keys.
 
-    def __init__(self, configuration, family, address, RequestHandlerClass):
+    """
+
+    check_interval = 10
+
+    def __init__(self, configuration):
+        self._certfile = configuration.get("server", "certificate")
+        self._keyfile = configuration.get("server", "key")
+        self._cafile = configuration.get("server", "certificate_authority")
+        self.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        for name, filename in (("certificate", self._certfile),
+                               ("key", self._keyfile),
+                               ("certificate_authority", self._cafile)):
+            if name == "certificate_authority" and not filename:
+                continue
+            if not os.path.isfile(filename):
+                raise RuntimeError("Invalid %s value for option %r in "
+                                   "section %r in %s: %r" % (
+                                       name, name, "server",
+                                       configuration.get_source(
+                                           "server", name), filename))
+        self._mtimes = self._get_mtimes()
+        self._load()
+        if self._cafile:
+            self.context.verify_mode = ssl.CERT_REQUIRED
+
+    def _get_mtimes(self):
+        return tuple(os.stat(filename).st_mtime_ns for filename in (
+            self._certfile, self._keyfile, self._cafile) if filename)
+
+    def _load(self):
+        self.context.load_cert_chain(self._certfile, self._keyfile)
+        if self._cafile:
+            self.context.load_verify_locations(self._cafile)
+
+    def check(self):
+        """Reload the certificate if the files changed.
+
+        Errors are logged and the previous certificate stays in use.
+
+        """
+        try:
+            mtimes = self._get_mtimes()
+            if mtimes == self._mtimes:
+                return
+            self._load()
+        except (OSError, ssl.SSLError) as e:
+            logger.error("Failed to reload certificate %r: %s",
+                         self._certfile, e, exc_info=True)
+            return
+        self._mtimes = mtimes
+        logger.info("Reloaded certificate %r", self._certfile)
+
+    def check_periodically(self, stop_event):
+        """Call ``check`` every ``check_interval`` seconds.
+
+        Returns when ``stop_event`` is set.
+
+        """
+        while not stop_event.wait(self.check_interval):
+            self.check()
+
+
+class WorkerPool:
+    """Fixed set of threads that serve accepted connections.
+
+    The accept loop selects on the pool (see ``fileno``) to be woken up when
+    a full queue has room again or a connection became idle.
+
+    """
+
+    def __init__(self, workers):
+        self._queue = queue.Queue(workers)
+        self._lock = threading.Lock()
+        self._notify = False
+        self._wakeup_socket, self._wakeup_socket_out = socket.socketpair()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, daemon=True,
+                                      name="Worker-%d" % i)
+            thread.start()
+            self._threads.append(thread)
+
+    def fileno(self):
+        return self._wakeup_socket.fileno()
+
+    def full(self):
+        with self._lock:
+            self._notify = self._queue.full()
+            return self._notify
+
+    def clear_wakeup(self):
+        self._wakeup_socket.recv(4096)
+
+    def wakeup(self):
+        """Wake up the accept loop."""
+        self._wakeup_socket_out.send(b"\0")
+
+    def submit(self, function, *args):
+        self._queue.put_nowait((function, args))
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            with self._lock:
+                if self._notify:
+                    self._notify = False
+                    self._wakeup_socket_out.send(b"\0")
+            if task is None:
+                break
+            function, args = task
+            function(*args)
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._wakeup_socket.close()
+        self._wakeup_socket_out.close()
+
+
+class ParallelHTTPServer(wsgiref.simple_server.WSGIServer):
+
+    def __init__(self, configuration, family, address, RequestHandlerClass,
+                 worker_pool=None, ssl_context_loader=None):
         self.configuration = configuration
         self.address_family = family
+        self.request_queue_size = configuration.get("server", "backlog")
+        self.worker_pool = worker_pool
+        self.ssl_context_loader = ssl_context_loader
+        # Set by the accept loop, which waits for the next request of idle
+        # connections
+        self.selector = None
+        self.closing = False
+        # Connections that became idle and aren't registered with the
+        # selector yet
+        self._new_idle_connections = []
+        self._new_idle_connections_lock = threading.Lock()
+        # Registered idle connections with the time when they expire (only
+        # used by the accept loop)
+        self._idle_connections = {}
+        # Connections whose workers wait for a request line
+        self.reading_connections = set()
         super().__init__(address, RequestHandlerClass)
-        self.client_sockets = set()
 
     def server_bind(self):
         if self.address_family == socket.AF_INET6:
@@ -48,20 +197,115 @@ class ParallelHTTPServer(socketserver.ThreadingMixIn,
         timeout = self.configuration.get("server", "timeout")
         if timeout:
             request.settimeout(timeout)
-        client_socket, client_socket_out = socket.socketpair()
-        self.client_sockets.add(client_socket_out)
-        return request, (*client_address, client_socket)
-
-    def finish_request_locked(self, request, client_address):
-        return super().finish_request(request, client_address)
+        if self.configuration.get("server", "tcp_nodelay"):
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.ssl_context_loader:
+            # The handshake is done by the worker thread
+            request = self.ssl_context_loader.context.wrap_socket(
+                request, server_side=True, do_handshake_on_connect=False)
+        return request, client_address
+
+    def close_idle_connections(self):
+        with self._new_idle_connections_lock:
+            self.closing = True
+            new_idle_connections = self._new_idle_connections
+            self._new_idle_connections = []
+        for connection, _ in new_idle_connections:
+            self.shutdown_request(connection)
+        for connection in self._idle_connections:
+            self.selector.unregister(connection)
+            self.shutdown_request(connection)
+        self._idle_connections.clear()
+        for connection in list(self.reading_connections):
+            with contextlib.suppress(OSError):
+                # Bypass SSLSocket.shutdown, the TLS connection is still in
+                # use by the worker
+                socket.socket.shutdown(connection, socket.SHUT_RD)
+
+    def keep_alive(self, request, client_address):
+        """Wait for the next request of ``request`` in the accept loop.
+
+        Idle connections don't occupy a worker.
+
+        """
+        with self._new_idle_connections_lock:
+            if not self.closing:
+                self._new_idle_connections.append((request, client_address))
+                request = None
+        if request is not None:
+            self.shutdown_request(request)
+            return
+        # The accept loop has to register the connection
+        self.worker_pool.wakeup()
+
+    def register_idle_connections(self):
+        """Register connections that became idle with the selector."""
+        with self._new_idle_connections_lock:
+            new_idle_connections = self._new_idle_connections
+            self._new_idle_connections = []
+        timeout = self.configuration.get("server", "timeout")
+        expires = time.monotonic() + timeout if timeout else None
+        for request, client_address in new_idle_connections:
+            self._idle_connections[request] = (client_address, expires)
+            self.selector.register(request, selectors.EVENT_READ, self)
+
+    def resume_connection(self, request):
+        """Serve the next request of the idle connection ``request``."""
+        self.selector.unregister(request)
+        client_address, _ = self._idle_connections.pop(request)
+        self.worker_pool.submit(self.process_request_worker, request,
+                                client_address, False)
+
+    def close_expired_connections(self):
+        """Close idle connections that timed out.
+
+        Returns the number of seconds until the next connection expires or
+        ``None``.
+
+        """
+        now = time.monotonic()
+        expired = []
+        next_expiry = None
+        for request, (_, expires) in self._idle_connections.items():
+            if expires is None:
+                continue
+            if expires <= now:
+                expired.append(request)
+            elif next_expiry is None or expires < next_expiry:
+                next_expiry = expires
+        for request in expired:
+            del self._idle_connections[request]
+            self.selector.unregister(request)
+            self.shutdown_request(request)
+        return None if next_expiry is None else next_expiry - now
+
+    def process_request(self, request, client_address):
+        self.worker_pool.submit(self.process_request_worker, request,
+                                client_address)
 
     def finish_request(self, request, client_address):
-        *client_address, client_socket = client_address
-        client_address = tuple(client_address)
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def process_request_worker(self, request, client_address,
+                               handshake=True):
+        keep_alive = False
         try:
-            return self.finish_request_locked(request, client_address)
+            if handshake and isinstance(request, ssl.SSLSocket):
+                try:
+                    request.do_handshake()
+                except (ssl.SSLError, OSError) as e:
+                    logger.info("TLS handshake with %r failed: %s",
+                                format_address(client_address), e)
+                    return
+            handler = self.finish_request(request, client_address)
+            keep_alive = not handler.close_connection
+        except Exception:
+            self.handle_error(request, client_address)
         finally:
-            client_socket.close()
+            if keep_alive:
+                self.keep_alive(request, client_address)
+            else:
+                self.shutdown_request(request)
 
     def handle_error(self, request, client_address):
         if issubclass(sys.exc_info()[0], socket.timeout):
@@ -70,17 +314,107 @@ class ParallelHTTPServer(socketserver.ThreadingMixIn,
             logger.error("An exception occurred during request: %s",
                          sys.exc_info()[1], exc_info=True)
 
+
+class RequestBody(io.RawIOBase):
+    """Body of a single request that is read from ``rfile`` (see
+    ``httputils.RequestBodyParser``)."""
+
+    def __init__(self, rfile, length=None):
+        super().__init__()
+        self._rfile = rfile
+        self._parser = httputils.RequestBodyParser(length)
+
+    def readable(self):
+        return True
+
+    def _run(self, reads):
+        try:
+            size = next(reads)
+            while True:
+                if size is None:
+                    data = self._rfile.readline(65537)
+                else:
+                    data = self._rfile.read(size)
+                size = reads.send(data)
+        except StopIteration as e:
+            return e.value
+
+    def readinto(self, buffer):
+        data = self._run(self._parser.read(len(buffer)))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def drain(self, max_size):
+        """Discard the rest of the body.
+
+        Returns ``False`` if more than ``max_size`` bytes are left or the
+        body is malformed.
+
+        """
+        try:
+            return self._run(self._parser.drain(max_size))
+        except (OSError, RuntimeError):
+            return False
+
+
 class ServerHandler(wsgiref.simple_server.ServerHandler):
 
     os_environ = {}
+    http_version = "1.1"
+    chunked = False
 
     def log_exception(self, exc_info):
         logger.error("An exception occurred during request: %s",
                      exc_info[1], exc_info=exc_info)
 
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        request_handler = self.request_handler
+        if "Content-Length" not in self.headers:
+            if request_handler.request_version == "HTTP/1.1":
+                self.headers["Transfer-Encoding"] = "chunked"
+                self.chunked = True
+            else:
+                request_handler.close_connection = True
+        if request_handler.close_connection:
+            self.headers["Connection"] = "close"
+        elif request_handler.request_version == "HTTP/1.0":
+            self.headers["Connection"] = "keep-alive"
+
+    def write(self, data):
+        assert type(data) is bytes, "write() argument must be a bytes instance"
+        if not self.status:
+            raise AssertionError("write() before start_response()")
+        if not self.headers_sent:
+            self.bytes_sent = len(data)
+            self.send_headers()
+        else:
+            self.bytes_sent += len(data)
+        if self.chunked:
+            if data:
+                self._write(b"%x\r\n" % len(data))
+                self._write(data)
+                self._write(b"\r\n")
+        else:
+            self._write(data)
+        self._flush()
+
+    def finish_content(self):
+        super().finish_content()
+        if self.chunked:
+            self._write(b"0\r\n\r\n")
+            self._flush()
+
+    def handle_error(self):
+        # The framing of the response is unknown after an error
+        self.request_handler.close_connection = True
+        super().handle_error()
+
 
 class RequestHandler(wsgiref.simple_server.WSGIRequestHandler):
 
+    protocol_version = "HTTP/1.1"
+
     def log_request(self, code="-", size="-"):
         pass
 
@@ -90,13 +424,47 @@ class RequestHandler(wsgiref.simple_server.WSGIRequestHandler):
     def get_environ(self):
         env = super().get_environ()
         if hasattr(self.connection, "getpeercert"):
+            env["HTTPS"] = "on"
             env["REMOTE_CERTIFICATE"] = self.connection.getpeercert()
         env["PATH_INFO"] = unquote(self.path.split("?", 1)[0])
         return env
 
     def handle(self):
+        # Pipelined requests are served right away, otherwise the
+        # connection waits for the next request in the accept loop (see
+        # ``ParallelHTTPServer.keep_alive``)
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._request_received():
+            self.handle_one_request()
+
+    def _request_received(self):
+        """Check without blocking if data of the next request is
+        available."""
+        timeout = self.connection.gettimeout()
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except ssl.SSLWantReadError:
+            return False
+        finally:
+            self.connection.settimeout(timeout)
 
-        self.raw_requestline = self.rfile.readline(65537)
+    def handle_one_request(self):
+        if self.server.closing:
+            self.close_connection = True
+            return
+        self.server.reading_connections.add(self.connection)
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = True
+            return
+        finally:
+            self.server.reading_connections.discard(self.connection)
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
         if len(self.raw_requestline) > 65536:
             self.requestline = ""
             self.request_version = ""
@@ -107,11 +475,112 @@ class RequestHandler(wsgiref.simple_server.WSGIRequestHandler):
         if not self.parse_request():
             return
 
+        environ = self.get_environ()
+        transfer_encoding = self.headers.get("Transfer-Encoding", "")
+        if transfer_encoding:
+            if transfer_encoding.strip().lower() != "chunked":
+                self.close_connection = True
+                self.send_error(501, "Unsupported transfer encoding")
+                return
+            # The length is given by the chunked transfer coding
+            environ.pop("CONTENT_LENGTH", None)
+            environ["wsgi.input_terminated"] = True
+            body = RequestBody(self.rfile)
+        else:
+            try:
+                content_length = int(environ.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                content_length = -1
+            if content_length < 0:
+                self.close_connection = True
+                self.send_error(400, "Invalid Content-Length")
+                return
+            body = RequestBody(self.rfile, content_length)
+
         handler = ServerHandler(
-            self.rfile, self.wfile, self.get_stderr(), self.get_environ()
+            body, self.wfile, self.get_stderr(), environ
         )
         handler.request_handler = self
         handler.run(self.server.get_app())
+        self.wfile.flush()
+        if (not self.close_connection and
+                not body.drain(httputils.MAX_DRAIN_SIZE)):
+            self.close_connection = True
+
+
+class Supervisor:
+    """Run the server in forked worker processes.
+
+    The listening sockets are bound before forking and inherited by the
+    workers. Workers that exit are restarted until shutdown is requested.
+
+    """
+
+    poll_interval = 1
+    restart_delay = 1
+
+    def __init__(self, processes, target):
+        self._processes = processes
+        self._target = target
+        self._workers = {}
+        self._restart_after = 0
+
+    def _spawn(self):
+        shutdown_socket, shutdown_socket_out = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                # The supervisor coordinates the shutdown
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                shutdown_socket.close()
+                for worker_socket, _ in self._workers.values():
+                    worker_socket.close()
+                self._target(shutdown_socket_out)
+                status = 0
+            except BaseException as e:
+                logger.fatal("An exception occurred in worker process: %s",
+                             e, exc_info=True)
+            finally:
+                os._exit(status)
+        shutdown_socket_out.close()
+        self._workers[pid] = (shutdown_socket, time.monotonic())
+        logger.info("Started worker process %d", pid)
+
+    def _reap(self, block=False):
+        for pid in list(self._workers):
+            pid, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+            if not pid:
+                continue
+            worker_socket, started = self._workers.pop(pid)
+            worker_socket.close()
+            if block:
+                continue
+            logger.warning("Worker process %d exited with status %d", pid,
+                           os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < self.restart_delay:
+                self._restart_after = time.monotonic() + self.restart_delay
+
+    def run(self, shutdown_socket=None):
+        selector = selectors.DefaultSelector()
+        try:
+            if shutdown_socket is not None:
+                selector.register(shutdown_socket, selectors.EVENT_READ)
+            while True:
+                if time.monotonic() >= self._restart_after:
+                    while len(self._workers) < self._processes:
+                        self._spawn()
+                if selector.select(self.poll_interval):
+                    logger.info("Stopping CDserver")
+                    break
+                self._reap()
+        finally:
+            selector.close()
+            # Workers finish their active requests when the socket is closed
+            for worker_socket, _ in self._workers.values():
+                worker_socket.close()
+            self._reap(block=True)
 
 
 def serve(configuration, shutdown_socket=None, login=None):
@@ -121,65 +590,137 @@ def serve(configuration, shutdown_socket=None, login=None):
                          privileged=True)
 
     application = Application(configuration)
+    if not configuration.get("server", "workers"):
+        raise RuntimeError("At least one worker is required")
+    processes = configuration.get("server", "processes")
+    if processes > 1 and not hasattr(os, "fork"):
+        raise RuntimeError("Multiple processes are not supported on %s" %
+                           sys.platform)
+    if login and processes <= 1:
+        application.provision(login)
+    ssl_context_loader = None
+    if configuration.get("server", "ssl"):
+        # Created before forking, the workers share the session ticket keys
+        ssl_context_loader = SSLContextLoader(configuration)
+    if configuration.get("server", "asyncio") and processes <= 1:
+        asyncserver.serve(configuration, shutdown_socket, application,
+                          ssl_context_loader=ssl_context_loader)
+        return
     servers = {}
     try:
-        address = ('localhost', 5232)
-        possible_families = (socket.AF_INET, socket.AF_INET6)
-        for family in possible_families:
-            try:
-                server = ParallelHTTPServer(configuration, family, address, RequestHandler)
-            except:
-                continue
-            servers[server.socket] = server
-            server.set_app(application)
-
-
-        
+        for address in configuration.get("server", "hosts"):
+            possible_families = (socket.AF_INET, socket.AF_INET6)
+            bind_ok = False
+            for i, family in enumerate(possible_families):
+                is_last = i == len(possible_families) - 1
+                try:
+                    server = ParallelHTTPServer(
+                        configuration, family, address, RequestHandler,
+                        ssl_context_loader=ssl_context_loader)
+                except OSError as e:
+                    # Ignore unsupported families (only one must work)
+                    if ((bind_ok or not is_last) and (
+                            isinstance(e, socket.gaierror) and (
+                                e.errno == socket.EAI_NONAME or
+                                e.errno == COMPAT_EAI_ADDRFAMILY or
+                                e.errno == COMPAT_EAI_NODATA) or
+                            e.errno == errno.EADDRNOTAVAIL or
+                            e.errno == errno.EAFNOSUPPORT or
+                            e.errno == errno.EPROTONOSUPPORT)):
+                        continue
+                    raise RuntimeError("Failed to start server %r: %s" % (
+                                           format_address(address), e)) from e
+                servers[server.socket] = server
+                bind_ok = True
+                server.set_app(application)
+                logger.info("Listening on %r",
+                            format_address(server.server_address))
         if not servers:
             raise RuntimeError("No servers started")
 
-        select_timeout = None
-        max_connections = 8
+        def serve_process(shutdown_socket):
+            try:
+                # The storage starts its maintenance thread on first use,
+                # the supervisor must not use it before forking
+                if login:
+                    application.provision(login)
+                if configuration.get("server", "asyncio"):
+                    asyncserver.serve(configuration, shutdown_socket,
+                                      application, sockets=list(servers),
+                                      ssl_context_loader=ssl_context_loader)
+                else:
+                    serve_connections(configuration, servers,
+                                      shutdown_socket, ssl_context_loader)
+            finally:
+                # Worker processes exit with os._exit, which doesn't run
+                # the exit handlers
+                application.close()
+
+        if processes > 1:
+            # Connections are accepted by whichever worker is faster
+            for server in servers.values():
+                server.socket.setblocking(False)
+            Supervisor(processes, serve_process).run(shutdown_socket)
+        else:
+            serve_connections(configuration, servers, shutdown_socket,
+                              ssl_context_loader)
+    finally:
+        for server in servers.values():
+            server.server_close()
+
+
+def serve_connections(configuration, servers, shutdown_socket=None,
+                      ssl_context_loader=None):
+    worker_pool = WorkerPool(configuration.get("server", "workers"))
+    # Only the pool and the shutdown socket are selected while the pool is
+    # full, the listening sockets and idle connections have to wait
+    selector = selectors.DefaultSelector()
+    full_selector = selectors.DefaultSelector()
+    for sel in (selector, full_selector):
+        sel.register(worker_pool, selectors.EVENT_READ)
+        if shutdown_socket is not None:
+            sel.register(shutdown_socket, selectors.EVENT_READ)
+    for server in servers.values():
+        server.worker_pool = worker_pool
+        server.selector = selector
+        selector.register(server.socket, selectors.EVENT_READ, server)
+    stop_event = threading.Event()
+    if ssl_context_loader:
+        threading.Thread(target=ssl_context_loader.check_periodically,
+                         args=(stop_event,), name="Certificate",
+                         daemon=True).start()
+    try:
         logger.info("CDserver server is ready")
         while True:
-            rlist = []
+            select_timeout = None
             for server in servers.values():
-                rlist.extend(server.client_sockets)
-            if len(rlist) < max_connections:
-                rlist.extend(servers)
-            if shutdown_socket is not None:
-                rlist.append(shutdown_socket)
-            rlist, _, _ = select.select(rlist, [], [], select_timeout)
-            rlist = set(rlist)
-            if shutdown_socket in rlist:
+                server.register_idle_connections()
+                timeout = server.close_expired_connections()
+                if timeout is not None and (select_timeout is None or
+                                            timeout < select_timeout):
+                    select_timeout = timeout
+            events = (full_selector if worker_pool.full() else
+                      selector).select(select_timeout)
+            if any(key.fileobj is shutdown_socket for key, _ in events):
                 logger.info("Stopping CDserver")
                 break
-            for server in servers.values():
-                finished_sockets = server.client_sockets.intersection(rlist)
-                for s in finished_sockets:
-                    s.close()
-                    server.client_sockets.remove(s)
-                    rlist.remove(s)
-                if finished_sockets:
-                    server.service_actions()
-            if rlist:
-                server = servers.get(rlist.pop())
-                if server:
+            for key, _ in events:
+                if key.fileobj is worker_pool:
+                    worker_pool.clear_wakeup()
+            for key, _ in events:
+                if key.fileobj is worker_pool:
+                    continue
+                if worker_pool.full():
+                    break
+                server = key.data
+                if key.fileobj is server.socket:
                     server.handle_request()
-
-            preffix = './CDserver/collections/collection-root'
-            try:
-                dirr = preffix + '/' + login + '/' + 'contacts'
-                os.makedirs(dirr)
-                props = open(dirr + '/' + '.CDserver.props', "w")
-                props.write('{"CR:addressbook-description": "description", "D:displayname": "contacts", "tag": "VADDRESSBOOK", "{http://inf-it.com/ns/ab/}addressbook-color": "#9b9eb4ff"}')
-                props.close()
-            except Exception as e:
-                print(e)
-
+                else:
+                    server.resume_connection(key.fileobj)
     finally:
+        stop_event.set()
         for server in servers.values():
-            for s in server.client_sockets:
-                s.recv(1)
-                s.close()
-            server.server_close()
+            server.close_idle_connections()
+        worker_pool.shutdown()
+        selector.close()
+        full_selector.close()
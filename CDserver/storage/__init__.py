@@ -55,6 +55,17 @@ class BaseCollection:
             raise ValueError("Sync token are not supported")
         return token, (item.href for item in self.get_all())
 
+    def sync_page(self, old_token=None, limit=None):
+        """Like ``sync`` but returns at most ``limit`` changes.
+
+        Returns the token, the changes and whether all changes were
+        returned. The token of an incomplete page only includes the
+        returned changes.
+
+        """
+        token, changes = self.sync(old_token)
+        return token, list(changes), True
+
     def get_multi(self, hrefs):
         raise NotImplementedError
 
@@ -77,10 +88,7 @@ class BaseCollection:
             yield item, item_simple
 
     def has_uid(self, uid):
-        for item in self.get_all():
-            if item.uid == uid:
-                return True
-        return False
+        return any(item.uid == uid for item in self.get_all())
 
     def upload(self, href, item):
         raise NotImplementedError
@@ -168,8 +176,16 @@ class BaseStorage:
         raise NotImplementedError
 
     @contextlib.contextmanager
-    def acquire_lock(self, mode, user=None):
+    def acquire_lock(self, mode, user=None, paths=None):
+        """Lock the storage for the access of ``paths``.
+
+        The whole storage is locked if ``paths`` is ``None``.
+
+        """
         raise NotImplementedError
 
     def verify(self):
         raise NotImplementedError
+
+    def close(self):
+        """Finish the work that the storage does in the background."""
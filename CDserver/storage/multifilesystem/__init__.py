@@ -1,30 +1,43 @@
+import binascii
 import contextlib
 import os
-import time
-from itertools import chain
-from tempfile import TemporaryDirectory
+import threading
 
 from CDserver import pathutils, storage
 from CDserver.storage.multifilesystem.cache import CollectionCacheMixin
 from CDserver.storage.multifilesystem.create_collection import \
     StorageCreateCollectionMixin
+from CDserver.storage.multifilesystem.ctag import CollectionCtagMixin
 from CDserver.storage.multifilesystem.delete import CollectionDeleteMixin
 from CDserver.storage.multifilesystem.discover import StorageDiscoverMixin
+from CDserver.storage.multifilesystem.durability import GroupSync
 from CDserver.storage.multifilesystem.get import CollectionGetMixin
-from CDserver.storage.multifilesystem.history import CollectionHistoryMixin
+from CDserver.storage.multifilesystem.item_index import \
+    CollectionItemIndexMixin
+from CDserver.storage.multifilesystem.journal import CollectionJournalMixin
 from CDserver.storage.multifilesystem.lock import (CollectionLockMixin,
                                                    StorageLockMixin)
+from CDserver.storage.multifilesystem.maintenance import (
+    CollectionMaintenanceMixin, StorageMaintenanceMixin)
+from CDserver.storage.multifilesystem.memory_cache import (CollectionCache,
+                                                           MemoryCache)
 from CDserver.storage.multifilesystem.meta import CollectionMetaMixin
 from CDserver.storage.multifilesystem.move import StorageMoveMixin
+from CDserver.storage.multifilesystem.snapshot import (
+    CollectionSnapshotMixin, StorageSnapshotMixin)
 from CDserver.storage.multifilesystem.sync import CollectionSyncMixin
+from CDserver.storage.multifilesystem.uid_index import CollectionUidIndexMixin
 from CDserver.storage.multifilesystem.upload import CollectionUploadMixin
 from CDserver.storage.multifilesystem.verify import StorageVerifyMixin
 
 
 class Collection(
-        CollectionCacheMixin, CollectionDeleteMixin, CollectionGetMixin,
-        CollectionHistoryMixin, CollectionLockMixin, CollectionMetaMixin,
-        CollectionSyncMixin, CollectionUploadMixin, storage.BaseCollection):
+        CollectionCacheMixin, CollectionCtagMixin, CollectionDeleteMixin,
+        CollectionGetMixin, CollectionItemIndexMixin, CollectionJournalMixin,
+        CollectionLockMixin, CollectionMaintenanceMixin, CollectionMetaMixin,
+        CollectionSnapshotMixin, CollectionSyncMixin, CollectionUidIndexMixin,
+        CollectionUploadMixin,
+        storage.BaseCollection):
 
     def __init__(self, storage_, path, filesystem_path=None):
         self._storage = storage_
@@ -34,45 +47,56 @@ class Collection(
         if filesystem_path is None:
             filesystem_path = pathutils.path_to_filesystem(folder, self.path)
         self._filesystem_path = filesystem_path
-        self._etag_cache = None
         super().__init__()
 
     @property
     def path(self):
         return self._path
 
+    def _forget_caches(self):
+        """Drop the cached indexes and properties of the collection."""
+        self._forget_ctag_state()
+        self._storage._item_index_cache.pop(self._filesystem_path, None)
+        self._storage._uid_index_cache.pop(self._filesystem_path, None)
+        self._storage._listing_cache.pop(self._filesystem_path, None)
+        self._storage._journal_cache.pop(self._filesystem_path, None)
+        self._storage._meta_cache.pop(self._props_path, None)
+
     @contextlib.contextmanager
-    def _atomic_write(self, path, mode="w", newline=None):
-        parent_dir, name = os.path.split(path)
-        with TemporaryDirectory(
-                prefix=".CDserver.tmp-", dir=parent_dir) as tmp_dir:
-            with open(os.path.join(tmp_dir, name), mode, newline=newline,
+    def _atomic_write(self, path, mode="w", newline=None, cache=False):
+        """Replace the file ``path``.
+
+        Files of caches (``cache``) are only synced if the mode
+        ``filesystem_sync`` is ``always``.
+
+        """
+        parent_dir = os.path.dirname(path)
+        # The temporary file is hidden from the listing of the collection and
+        # removed by the maintenance if the process dies
+        tmp_path = os.path.join(parent_dir, ".CDserver.tmp-%s" %
+                                binascii.hexlify(os.urandom(8)).decode())
+        try:
+            with open(tmp_path, mode.replace("w", "x"), newline=newline,
                       encoding=None if "b" in mode else self._encoding) as tmp:
                 yield tmp
                 tmp.flush()
-                self._storage._fsync(tmp)
-            os.replace(os.path.join(tmp_dir, name), path)
-        self._storage._sync_directory(parent_dir)
-
-    @property
-    def last_modified(self):
-        relevant_files = chain(
-            (self._filesystem_path,),
-            (self._props_path,) if os.path.exists(self._props_path) else (),
-            (os.path.join(self._filesystem_path, h) for h in self._list()))
-        last = max(map(os.path.getmtime, relevant_files))
-        return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(last))
-
-    @property
-    def etag(self):
-        if self._storage._lock.locked == "w" or self._etag_cache is None:
-            self._etag_cache = super().etag
-        return self._etag_cache
+                if cache:
+                    self._storage._fsync_cache(tmp)
+                else:
+                    self._storage._fsync(tmp)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        if not cache or self._storage._filesystem_sync == "always":
+            self._storage._sync_directory(parent_dir)
 
 
 class Storage(
         StorageCreateCollectionMixin, StorageDiscoverMixin, StorageLockMixin,
-        StorageMoveMixin, StorageVerifyMixin, storage.BaseStorage):
+        StorageMaintenanceMixin, StorageMoveMixin, StorageSnapshotMixin,
+        StorageVerifyMixin, storage.BaseStorage):
 
     _collection_class = Collection
 
@@ -80,6 +104,30 @@ class Storage(
         super().__init__(configuration)
         folder = configuration.get("storage", "filesystem_folder")
         self._makedirs_synced(folder)
+        max_collections = configuration.get(
+            "storage", "memory_cache_collections")
+        # Etags and modification times of collections by filesystem path
+        self._ctag_cache = CollectionCache(max_collections)
+        # Parsed properties of collections by filesystem path of the file
+        self._meta_cache = CollectionCache(max_collections)
+        # Items and children of collections by filesystem path
+        self._listing_cache = CollectionCache(max_collections)
+        # UID indexes of collections by filesystem path
+        self._uid_index_cache = CollectionCache(max_collections)
+        # Item indexes of collections by filesystem path
+        self._item_index_cache = CollectionCache(max_collections)
+        # Change journals of collections by filesystem path
+        self._journal_cache = CollectionCache(max_collections)
+        self._memory_cache = MemoryCache(
+            configuration.get("storage", "memory_cache_items"),
+            configuration.get("storage", "memory_cache_size"))
+        self._memory_cache_text = configuration.get(
+            "storage", "memory_cache_text")
+        self._filesystem_sync = configuration.get(
+            "storage", "filesystem_sync")
+        # Folders that are synced at the end of the current request
+        self._deferred_syncs = threading.local()
+        self._group_sync = GroupSync(self._sync_group)
 
     def _get_collection_root_folder(self):
         filesystem_folder = self.configuration.get(
@@ -94,9 +142,84 @@ class Storage(
                 raise RuntimeError("Fsync'ing file %r failed: %s" %
                                    (f.name, e)) from e
 
-    def _sync_directory(self, path):
+    def _fsync_deferrable(self, f):
+        """Sync the file ``f`` now or with the folders at the end of the
+        request."""
+        paths = getattr(self._deferred_syncs, "paths", None)
+        if paths is None:
+            self._fsync(f)
+        elif self.configuration.get("storage", "_filesystem_fsync"):
+            paths.add(f.name)
+
+    def _fsync_cache(self, f):
+        # Caches are checked when they are loaded, they don't have to
+        # survive crashes
+        if self._filesystem_sync == "always":
+            self._fsync(f)
+
+    @contextlib.contextmanager
+    def _defer_syncs(self):
+        """Sync the modified folders once at the end of the block.
+
+        Files are still synced before they are renamed.
+
+        """
+        if (self._filesystem_sync == "always" or
+                getattr(self._deferred_syncs, "paths", None) is not None):
+            yield
+            return
+        self._deferred_syncs.paths = set()
+        try:
+            yield
+        finally:
+            try:
+                self._sync_deferred()
+            finally:
+                self._deferred_syncs.paths = None
+
+    def _sync_deferred(self):
+        """Sync the paths that were deferred so far in the current block."""
+        paths = getattr(self._deferred_syncs, "paths", None)
+        if not paths:
+            return
+        pending = set(paths)
+        paths.clear()
+        if self._filesystem_sync == "group":
+            self._group_sync.sync(pending)
+        else:
+            self._sync_paths(pending)
+
+    def _sync_paths(self, paths):
+        for path in paths:
+            try:
+                self._sync_directory(path, deferrable=False)
+            except RuntimeError as e:
+                # The folder was deleted later in the request
+                if not isinstance(e.__cause__, FileNotFoundError):
+                    raise
+
+    def _sync_group(self, paths):
+        if not pathutils.HAVE_SYNCFS:
+            self._sync_paths(paths)
+            return
+        # One sync of the filesystem is cheaper than syncing the folders
+        # of many requests
+        folder = self.configuration.get("storage", "filesystem_folder")
+        try:
+            pathutils.syncfs(folder)
+        except OSError as e:
+            raise RuntimeError("Syncing filesystem of %r failed: %s" %
+                               (folder, e)) from e
+
+    def _sync_directory(self, path, deferrable=True):
+        # Files that are added by ``_fsync_deferrable`` are synced the same
+        # way
         if not self.configuration.get("storage", "_filesystem_fsync"):
             return
+        paths = getattr(self._deferred_syncs, "paths", None)
+        if deferrable and paths is not None:
+            paths.add(path)
+            return
         if os.name == "posix":
             try:
                 fd = os.open(path, 0)
@@ -33,12 +33,19 @@ class StorageCreateCollectionMixin:
                     col._upload_all_nonatomic(items, suffix=".ics")
                 elif props.get("tag") == "VADDRESSBOOK":
                     col._upload_all_nonatomic(items, suffix=".vcf")
+            # The content must be synced before the collection is renamed
+            self._sync_directory(tmp_filesystem_path, deferrable=False)
 
             if os.path.lexists(filesystem_path):
+                self._collection_class(
+                    self, pathutils.unstrip_path(sane_path, True)
+                )._preserve_all_versions()
                 pathutils.rename_exchange(tmp_filesystem_path, filesystem_path)
             else:
                 os.rename(tmp_filesystem_path, filesystem_path)
             self._sync_directory(parent_dir)
+            # The caches of the temporary path are never used again
+            col._forget_caches()
 
         return self._collection_class(
             self, pathutils.unstrip_path(sane_path, True))
@@ -0,0 +1,165 @@
+import contextlib
+import json
+import os
+import pickle
+import time
+from itertools import chain
+
+from CDserver import item as CDserver_item
+from CDserver.log import logger
+
+# Timestamps of files are coarse, a folder that was modified within this
+# number of seconds can change again without getting a new timestamp
+RACY_INTERVAL = 2
+
+
+def is_racy(mtime_ns):
+    """Check if a file or folder was modified too recently to be cached."""
+    return mtime_ns >= time.time_ns() - RACY_INTERVAL * 10**9
+
+
+class CollectionCtagMixin:
+    """Maintain the etag and the last modification time of collections.
+
+    Both are updated by the storage operations and stored in
+    ``.CDserver.cache/ctag`` until the folder or the properties change.
+
+    """
+
+    def _get_ctag_stamp(self):
+        """Get the stamp of the folder and the properties of the collection.
+
+        Returns the inode and the modification time of the folder and the
+        modification time, inode and size of the properties.
+
+        """
+        stat = os.stat(self._filesystem_path)
+        try:
+            props_stat = os.stat(self._props_path)
+        except FileNotFoundError:
+            return stat.st_ino, stat.st_mtime_ns, 0, 0, 0
+        return (stat.st_ino, stat.st_mtime_ns, props_stat.st_mtime_ns,
+                props_stat.st_ino, props_stat.st_size)
+
+    @staticmethod
+    def _get_ctag_stamp_mtime_ns(stamp):
+        """Get the newest modification time of ``stamp``."""
+        return max(stamp[1], stamp[2])
+
+    def _load_ctag_state(self, stamp):
+        path = os.path.join(self._filesystem_path, ".CDserver.cache", "ctag")
+        try:
+            with open(path, "rb") as f:
+                cache_stamp, etag, last_modified = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError, ValueError) as e:
+            logger.warning("Failed to load ctag cache of %r: %s",
+                           self.path, e, exc_info=True)
+            return None
+        if tuple(cache_stamp) != stamp:
+            return None
+        return etag, last_modified
+
+    def _remember_ctag_state(self, stamp, state):
+        ctag_cache = self._storage._ctag_cache
+        if not is_racy(self._get_ctag_stamp_mtime_ns(stamp)):
+            ctag_cache[self._filesystem_path] = (stamp, state)
+        else:
+            ctag_cache.pop(self._filesystem_path, None)
+
+    def _store_ctag_state(self, etag, last_modified, stamp=None):
+        """Store the state, ``stamp`` defaults to the current stamp."""
+        cache_folder = os.path.join(self._filesystem_path, ".CDserver.cache")
+        self._storage._makedirs_synced(cache_folder)
+        if stamp is None:
+            stamp = self._get_ctag_stamp()
+        state = (etag, max(last_modified,
+                           self._get_ctag_stamp_mtime_ns(stamp) / 10**9))
+        try:
+            with self._atomic_write(os.path.join(cache_folder, "ctag"),
+                                    "wb", cache=True) as f:
+                pickle.dump((stamp, *state), f)
+        except PermissionError:
+            pass
+        self._remember_ctag_state(stamp, state)
+        return state
+
+    def _get_ctag_state(self):
+        stamp = self._get_ctag_stamp()
+        cached = self._storage._ctag_cache.get(self._filesystem_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        state = self._load_ctag_state(stamp)
+        if state is None:
+            with self._acquire_cache_lock("ctag"):
+                if self._locked == "r":
+                    state = self._load_ctag_state(self._get_ctag_stamp())
+                if state is None:
+                    logger.debug("Calculating ctag of %r", self.path)
+                    # Taken before the items are read, items that are found
+                    # to be edited in place meanwhile invalidate the result
+                    stamp = self._get_ctag_stamp()
+                    return self._store_ctag_state(
+                        super().etag, self._get_last_modified_from_files(),
+                        stamp)
+        self._remember_ctag_state(stamp, state)
+        return state
+
+    def _update_ctag_state(self, state, items=(), props=None):
+        """Derive the new state from ``state`` and the changes.
+
+        ``items`` are pairs of hrefs and the new items (``None`` for deleted
+        items), ``props`` are the new properties. ``state`` must be
+        retrieved before the collection was modified.
+
+        """
+        old_etag, last_modified = state
+        etag = old_etag
+        for href, item in items:
+            etag = CDserver_item.get_etag("%s/%s/%s" % (
+                etag.strip("\""), href, item.etag if item else ""))
+        if props is not None:
+            etag = CDserver_item.get_etag("%s/.CDserver.props/%s" % (
+                etag.strip("\""), json.dumps(props, sort_keys=True)))
+        state = self._store_ctag_state(etag, last_modified)
+        self._update_uid_index(old_etag, etag, items)
+        self._update_journal(old_etag, etag, items)
+        return state
+
+    def _forget_ctag_state(self):
+        self._storage._ctag_cache.pop(self._filesystem_path, None)
+
+    def _invalidate_ctag_state(self):
+        """Calculate the etag again after an item was modified without the
+        storage.
+
+        The modification time of the folder is updated, so the other
+        processes notice it too.
+
+        """
+        logger.debug("Found item that was modified in place in %r",
+                     self.path)
+        with contextlib.suppress(FileNotFoundError, PermissionError):
+            os.remove(os.path.join(
+                self._filesystem_path, ".CDserver.cache", "ctag"))
+        with contextlib.suppress(PermissionError):
+            os.utime(self._filesystem_path)
+        self._forget_ctag_state()
+
+    def _get_last_modified_from_files(self):
+        relevant_files = chain(
+            (self._filesystem_path,),
+            (self._props_path,) if os.path.exists(self._props_path) else (),
+            (os.path.join(self._filesystem_path, h) for h in self._list()))
+        return max(map(os.path.getmtime, relevant_files))
+
+    @property
+    def etag(self):
+        return self._get_ctag_state()[0]
+
+    @property
+    def last_modified(self):
+        last_modified = self._get_ctag_state()[1]
+        return time.strftime("%a, %d %b %Y %H:%M:%S GMT",
+                             time.gmtime(last_modified))
@@ -7,10 +7,12 @@ from CDserver import pathutils, storage
 class CollectionDeleteMixin:
     def delete(self, href=None):
         if href is None:
+            self._forget_caches()
             parent_dir = os.path.dirname(self._filesystem_path)
             try:
                 os.rmdir(self._filesystem_path)
             except OSError:
+                self._preserve_all_versions()
                 with TemporaryDirectory(
                         prefix=".CDserver.tmp-", dir=parent_dir) as tmp:
                     os.rename(self._filesystem_path, os.path.join(
@@ -24,7 +26,9 @@ class CollectionDeleteMixin:
             path = pathutils.path_to_filesystem(self._filesystem_path, href)
             if not os.path.isfile(path):
                 raise storage.ComponentNotFoundError(href)
+            ctag_state = self._get_ctag_state()
+            self._preserve_versions([href])
             os.remove(path)
             self._storage._sync_directory(os.path.dirname(path))
-            self._update_history_etag(href, None)
-            self._clean_history()
+            self._update_item_index([(href, None)])
+            self._update_ctag_state(ctag_state, [(href, None)])
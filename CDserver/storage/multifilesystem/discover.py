@@ -43,20 +43,16 @@ class StorageDiscoverMixin:
         if depth == "0":
             return
 
-        for href in collection._list():
+        hrefs, children = collection._scan()
+        for href in hrefs:
             with child_context_manager(sane_path, href):
                 yield collection._get(href)
 
-        for entry in os.scandir(filesystem_path):
-            if not entry.is_dir():
-                continue
-            href = entry.name
-            if not pathutils.is_safe_filesystem_path_component(href):
-                if not href.startswith(".CDserver"):
-                    logger.debug("Skipping collection %r in %r",
-                                 href, sane_path)
-                continue
+        for href in children:
             sane_child_path = posixpath.join(sane_path, href)
             child_path = pathutils.unstrip_path(sane_child_path, True)
             with child_context_manager(sane_child_path):
-                yield self._collection_class(self, child_path)
+                # The name was listed, it doesn't collide
+                yield self._collection_class(
+                    self, child_path,
+                    filesystem_path=os.path.join(filesystem_path, href))
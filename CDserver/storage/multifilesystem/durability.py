@@ -0,0 +1,56 @@
+import threading
+
+
+class _Group:
+    def __init__(self):
+        self.paths = set()
+        self.done = False
+        self.error = None
+
+
+class GroupSync:
+    """Combine the syncs of concurrent requests.
+
+    The first request syncs the paths of all waiting requests with
+    ``sync_paths``, requests that arrive meanwhile are synced together
+    afterwards.
+
+    """
+
+    def __init__(self, sync_paths):
+        self._sync_paths = sync_paths
+        self._condition = threading.Condition()
+        self._group = _Group()
+        self._syncing = False
+        self.syncs = 0
+        self.requests = 0
+
+    def __repr__(self):
+        return "<%s: %d requests in %d syncs>" % (
+            type(self).__name__, self.requests, self.syncs)
+
+    def sync(self, paths):
+        with self._condition:
+            group = self._group
+            group.paths.update(paths)
+            self.requests += 1
+            while not group.done:
+                if self._syncing:
+                    self._condition.wait()
+                    continue
+                self._syncing = True
+                self._group = _Group()
+                self._condition.release()
+                try:
+                    self._sync_paths(group.paths)
+                except Exception as e:
+                    group.error = e
+                finally:
+                    self._condition.acquire()
+                    self._syncing = False
+                    group.done = True
+                    self.syncs += 1
+                    self._condition.notify_all()
+            if group.error is not None:
+                raise RuntimeError("Sync failed: %s" % group.error) from (
+                    group.error)
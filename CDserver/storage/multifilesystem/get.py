@@ -1,28 +1,47 @@
+import functools
 import os
 import time
+from stat import S_ISREG
 
 import vobject
 
 from CDserver import item as CDserver_item
 from CDserver import pathutils
 from CDserver.log import logger
+from CDserver.storage.multifilesystem.ctag import is_racy
 
 
 class CollectionGetMixin:
-    def __init__(self):
-        super().__init__()
-        self._item_cache_cleaned = False
-
-    def _list(self):
+    def _scan(self):
+        """List the hrefs of the items and the names of the children,
+        cached until the folder is modified."""
+        stat = os.stat(self._filesystem_path)
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        cached = self._storage._listing_cache.get(self._filesystem_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        hrefs = []
+        children = []
         for entry in os.scandir(self._filesystem_path):
-            if not entry.is_file():
+            if entry.is_dir():
+                names = children
+            elif entry.is_file():
+                names = hrefs
+            else:
                 continue
-            href = entry.name
-            if not pathutils.is_safe_filesystem_path_component(href):
-                if not href.startswith(".CDserver"):
-                    logger.debug("Skipping item %r in %r", href, self.path)
+            if not pathutils.is_safe_filesystem_path_component(entry.name):
+                if not entry.name.startswith(".CDserver"):
+                    logger.debug("Skipping %r in %r", entry.name, self.path)
                 continue
-            yield href
+            names.append(entry.name)
+        listing = (tuple(hrefs), tuple(children))
+        if not is_racy(stat.st_mtime_ns):
+            self._storage._listing_cache[self._filesystem_path] = (
+                stamp, listing)
+        return listing
+
+    def _list(self):
+        return iter(self._scan()[0])
 
     def _get(self, href, verify_href=True):
         if verify_href:
@@ -39,48 +58,117 @@ class CollectionGetMixin:
         else:
             path = os.path.join(self._filesystem_path, href)
         try:
-            with open(path, "rb") as f:
-                raw_text = f.read()
-        except (FileNotFoundError, IsADirectoryError):
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if not S_ISREG(stat.st_mode):
             return None
-        except PermissionError:
-            if (os.name == "nt" and
-                    os.path.isdir(path) and os.access(path, os.R_OK)):
+        identity = self._item_cache_identity(stat)
+        memory_cache = self._storage._memory_cache
+        memory_cache_key = None
+        cached = None
+        if identity is not None:
+            memory_cache_key = (self._filesystem_path, href, identity)
+            cached = memory_cache.get(memory_cache_key)
+        if cached is not None:
+            entry, text = cached
+        else:
+            entry, text = self._load_item_entry(href, path, identity)
+            if entry is None:
                 return None
-            raise
-        input_hash = self._item_cache_hash(raw_text)
-        cache_hash, uid, etag, text, name, tag, start, end = \
-            self._load_item_cache(href, input_hash)
-        if input_hash != cache_hash:
-            with self._acquire_cache_lock("item"):
-                if self._storage._lock.locked == "r":
-                    cache_hash, uid, etag, text, name, tag, start, end = \
-                        self._load_item_cache(href, input_hash)
-                if input_hash != cache_hash:
-                    try:
-                        vobject_items = tuple(vobject.readComponents(
-                            raw_text.decode(self._encoding)))
-                        CDserver_item.check_and_sanitize_items(
-                            vobject_items, tag=self.get_meta("tag"))
-                        vobject_item, = vobject_items
-                        temp_item = CDserver_item.Item(
-                            collection=self, vobject_item=vobject_item)
-                        cache_hash, uid, etag, text, name, tag, start, end = \
-                            self._store_item_cache(
-                                href, temp_item, input_hash)
-                    except Exception as e:
-                        raise RuntimeError("Failed to load item %r in %r: %s" %
-                                           (href, self.path, e)) from e
-                    if not self._item_cache_cleaned:
-                        self._item_cache_cleaned = True
-                        self._clean_item_cache()
+            if memory_cache_key is not None:
+                memory_cache.put(memory_cache_key, entry, text if
+                                 self._storage._memory_cache_text else None)
+        return self._make_item(href, path, stat, entry, text,
+                               memory_cache_key)
+
+    def _make_item(self, href, path, stat, entry, text,
+                   memory_cache_key=None, vobject_item=None):
+        """Create the item for the index ``entry`` of the file ``path``.
+
+        The text is read when it's used if ``text`` is ``None``.
+
+        """
+        _, _, uid, etag, name, tag, start, end, cached_text = entry
+        if cached_text is not None:
+            text = cached_text
         last_modified = time.strftime(
-            "%a, %d %b %Y %H:%M:%S GMT",
-            time.gmtime(os.path.getmtime(path)))
+            "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(stat.st_mtime))
         return CDserver_item.Item(
             collection=self, href=href, last_modified=last_modified, etag=etag,
-            text=text, uid=uid, name=name, component_name=tag,
-            time_range=(start, end))
+            text=text, vobject_item=vobject_item, uid=uid, name=name,
+            component_name=tag, time_range=(start, end),
+            load_text=None if text is not None else functools.partial(
+                self._read_item_text, path, memory_cache_key, entry))
+
+    def _load_item_entry(self, href, path, identity):
+        """Get the index entry of an item and the text if it was read.
+
+        Returns ``(None, None)`` if the item doesn't exist.
+
+        """
+        entry = self._get_item_index().get(href)
+        # Skip reading the item if the file wasn't modified
+        if entry is not None and identity is not None and entry[1] == identity:
+            return entry, None
+        try:
+            with open(path, "rb") as f:
+                raw_text = f.read()
+        except FileNotFoundError:
+            return None, None
+        input_hash = self._item_cache_hash(raw_text)
+        if entry is None or entry[0] != input_hash:
+            with self._acquire_cache_lock("item"):
+                if self._locked == "r":
+                    entry = self._get_item_index(refresh=True).get(href)
+                if entry is None or entry[0] != input_hash:
+                    modified = entry is not None
+                    entry = self._update_item_cache(
+                        href, raw_text, input_hash, identity)
+                    if modified:
+                        self._invalidate_ctag_state()
+        elif identity is not None:
+            # The content is unchanged, only remember the metadata
+            entry = (entry[0], identity, *entry[2:])
+            with self._acquire_cache_lock("item"):
+                self._update_item_index([(href, entry)])
+        return entry, raw_text.decode(self._encoding)
+
+    def _read_item_text(self, path, memory_cache_key, entry):
+        """Read the text of the version of the item that ``entry`` is for,
+        the storage doesn't have to be locked."""
+        try:
+            with open(path, "rb") as f:
+                raw_text = f.read()
+                identity = self._item_cache_identity(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            raw_text = identity = None
+        if raw_text is None or (
+                memory_cache_key is None or
+                identity != memory_cache_key[2]) and (
+                self._item_cache_hash(raw_text) != entry[0]):
+            raw_text = self._read_version(entry[0])
+        text = raw_text.decode(self._encoding)
+        if memory_cache_key is not None and self._storage._memory_cache_text:
+            self._storage._memory_cache.put(memory_cache_key, entry, text)
+        return text
+
+    def _update_item_cache(self, href, raw_text, input_hash, identity):
+        try:
+            vobject_items = tuple(vobject.readComponents(
+                raw_text.decode(self._encoding)))
+            CDserver_item.check_and_sanitize_items(
+                vobject_items, tag=self.get_meta("tag"))
+            vobject_item, = vobject_items
+            temp_item = CDserver_item.Item(
+                collection=self, vobject_item=vobject_item)
+            entry = self._item_cache_content(
+                temp_item, input_hash, identity, raw_text)
+        except Exception as e:
+            raise RuntimeError("Failed to load item %r in %r: %s" %
+                               (href, self.path, e)) from e
+        self._update_item_index([(href, entry)])
+        return entry
 
     def get_multi(self, hrefs):
         files = None
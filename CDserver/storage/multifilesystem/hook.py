@@ -0,0 +1,166 @@
+import atexit
+import contextlib
+import json
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import fcntl
+
+from CDserver.log import logger
+
+
+class HookRunner:
+    """Run the storage hook in a background thread.
+
+    The hook is run ``delay`` seconds after the first change of a user and
+    includes the later changes. Runs of all processes are serialized with
+    the lock file ``.CDserver.lock.hook``, which also stores when the last
+    run of each user started.
+
+    """
+
+    def __init__(self, command, folder, delay):
+        self._command = command
+        self._folder = folder
+        self._delay = delay
+        self.runs = 0
+        self.failures = 0
+        self.coalesced = 0
+        self._reset()
+        atexit.register(self.close)
+        # The thread and the pending runs aren't inherited by forked
+        # processes
+        runner = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: runner() and
+                            runner()._reset())
+
+    def _reset(self):
+        self._condition = threading.Condition()
+        # Times when the hook is due and of the first change by user
+        self._pending = OrderedDict()
+        self._closing = False
+        self._thread = None
+
+    def __repr__(self):
+        return "<%s: %d runs, %d failures, %d coalesced, %d pending>" % (
+            type(self).__name__, self.runs, self.failures, self.coalesced,
+            len(self._pending))
+
+    def schedule(self, user):
+        changed = time.time()
+        with self._condition:
+            closing = self._closing
+            if not closing:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run_pending, name="Hook", daemon=True)
+                    self._thread.start()
+                if user in self._pending:
+                    self.coalesced += 1
+                    return
+                self._pending[user] = (time.monotonic() + self._delay,
+                                       changed)
+                self._condition.notify_all()
+        if closing:
+            self._run_logged(user, changed)
+
+    def close(self):
+        """Run the pending hooks and stop the thread."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run_pending(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending:
+                        user, (due, changed) = next(
+                            iter(self._pending.items()))
+                        timeout = due - time.monotonic()
+                        if timeout <= 0 or self._closing:
+                            del self._pending[user]
+                            break
+                    elif self._closing:
+                        return
+                    else:
+                        timeout = None
+                    self._condition.wait(timeout)
+            self._run_logged(user, changed)
+
+    def _run_logged(self, user, changed):
+        try:
+            if not self._run(user, changed):
+                self.coalesced += 1
+                return
+        except Exception as e:
+            self.failures += 1
+            logger.error("Storage hook for user %r failed: %s", user, e,
+                         exc_info=True)
+        self.runs += 1
+        logger.debug("Storage hook: %r", self)
+
+    def _run(self, user, changed):
+        """Run the hook for the changes of ``user`` since ``changed``.
+
+        Returns ``False`` if another run started after the changes.
+
+        """
+        debug = logger.isEnabledFor(logging.DEBUG)
+        popen_kwargs = dict(
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, shell=True, universal_newlines=True,
+            cwd=self._folder)
+        if os.name == "posix":
+            popen_kwargs["preexec_fn"] = os.setpgrp
+        elif os.name == "nt":
+            popen_kwargs["creationflags"] = (
+                subprocess.CREATE_NEW_PROCESS_GROUP)
+        command = self._command % {"user": shlex.quote(user or "Anonymous")}
+        lock_path = os.path.join(self._folder, ".CDserver.lock.hook")
+        with open(lock_path, "a+") as lock_file:
+            # Hooks like git commit fail if they run concurrently
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            lock_file.seek(0)
+            try:
+                started = json.loads(lock_file.read() or "{}")
+            except ValueError:
+                started = {}
+            if started.get(user or "", 0) > changed:
+                logger.debug("Storage hook for user %r already started",
+                             user)
+                return False
+            started[user or ""] = time.time()
+            lock_file.truncate(0)
+            json.dump(started, lock_file)
+            lock_file.flush()
+            logger.debug("Running storage hook for user %r", user)
+            p = subprocess.Popen(command, **popen_kwargs)
+            try:
+                stdout_data, stderr_data = p.communicate()
+            except BaseException:
+                p.kill()
+                p.wait()
+                raise
+            finally:
+                if os.name == "posix":
+                    with contextlib.suppress(OSError):
+                        os.killpg(p.pid, signal.SIGKILL)
+        if p.returncode != 0:
+            raise RuntimeError("Command exited with status %d:\n%s" % (
+                p.returncode, stderr_data or stdout_data))
+        if debug and stdout_data:
+            logger.debug("Captured stdout from hook:\n%s", stdout_data)
+        if debug and stderr_data:
+            logger.debug("Captured stderr from hook:\n%s", stderr_data)
+        return True
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+from CDserver import storage
+from CDserver.log import logger
+from CDserver.storage.multifilesystem.records import (COMPACT_SLACK,
+                                                      RecordFile)
+
+
+class ItemIndex(RecordFile):
+    """Cached entries of the items of a collection by href.
+
+    The file ``.CDserver.cache/items`` starts with the cache version,
+    followed by records of hrefs and entries (``None`` for deleted items).
+
+    """
+
+    def clear(self):
+        self.entries = {}
+
+    def read_header(self, header):
+        return header == storage.CACHE_VERSION
+
+    def apply(self, record):
+        href, entry = record
+        if entry is None:
+            self.entries.pop(href, None)
+        else:
+            self.entries[href] = entry
+
+
+class CollectionItemIndexMixin:
+    """Maintain the index of the cached items of a collection."""
+
+    def __init__(self):
+        super().__init__()
+        self._item_index_refreshed = False
+
+    @property
+    def _item_index_path(self):
+        return os.path.join(self._filesystem_path, ".CDserver.cache", "items")
+
+    def _get_item_index_object(self):
+        return self._storage._item_index_cache.setdefault(
+            self._filesystem_path, ItemIndex())
+
+    def _get_item_index(self, refresh=False):
+        """Get the entries of the items by href.
+
+        The returned dictionary must not be modified.
+
+        """
+        index = self._get_item_index_object()
+        with index.lock:
+            if refresh or not self._item_index_refreshed:
+                self._item_index_refreshed = True
+                try:
+                    index.refresh(self._item_index_path)
+                except OSError as e:
+                    logger.warning("Failed to load item index of %r: %s",
+                                   self.path, e, exc_info=True)
+            return index.entries
+
+    def _update_item_index(self, records):
+        """Append ``records`` of hrefs and entries to the index.
+
+        Entries of deleted items are ``None``. The storage must be locked
+        exclusively or the cache lock ``item`` must be held.
+
+        """
+        index = self._get_item_index_object()
+        with index.lock:
+            index.refresh(self._item_index_path)
+            self._item_index_refreshed = True
+            compact = (not index.complete or not os.path.exists(
+                self._item_index_path) or index.records + len(records) >
+                2 * len(index.entries) + COMPACT_SLACK)
+            try:
+                if compact:
+                    self._rewrite_item_index(index, records)
+                else:
+                    with open(self._item_index_path, "ab") as f:
+                        index.append(f, records)
+                        f.flush()
+                        self._storage._fsync_cache(f)
+            except PermissionError:
+                pass
+
+    def _rewrite_item_index(self, index, records):
+        for record in records:
+            index.apply(record)
+        hrefs = set(self._list())
+        for href in [href for href in index.entries if href not in hrefs]:
+            logger.debug("Found expired item in index: %r", href)
+            del index.entries[href]
+        cache_folder = os.path.dirname(self._item_index_path)
+        self._storage._makedirs_synced(cache_folder)
+        # Older versions stored one file per item
+        shutil.rmtree(os.path.join(cache_folder, "item"), ignore_errors=True)
+        self._clean_versions()
+        with self._atomic_write(self._item_index_path, "wb",
+                                cache=True) as f:
+            index.rewrite(f, storage.CACHE_VERSION,
+                          list(index.entries.items()))
+        index.set_ino(os.stat(self._item_index_path).st_ino)
@@ -0,0 +1,209 @@
+import binascii
+import bisect
+import os
+import shutil
+import time
+
+from CDserver.log import logger
+from CDserver.storage.multifilesystem.records import (COMPACT_SLACK,
+                                                      RecordFile)
+
+
+class Journal(RecordFile):
+    """Changes of the items of a collection.
+
+    The file ``.CDserver.cache/journal`` starts with the ID of the journal
+    and the first valid sequence number, followed by records of sequence
+    numbers, hrefs, etags (empty for deleted items) and timestamps. Records
+    without href contain the etag of the collection.
+
+    """
+
+    def clear(self):
+        self.id = None
+        self.base = 0
+        self.seq = 0
+        self.collection_etag = None
+        # Last change of the items by href: (etag, seq, timestamp)
+        self.state = {}
+        self._seqs = []
+        self._hrefs = []
+
+    def read_header(self, header):
+        if isinstance(header, str):
+            # Journals of older versions don't contain the base
+            header = (header, 0)
+        try:
+            self.id, self.base = header
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def apply(self, record):
+        seq, href, etag, timestamp = record
+        if href is None:
+            self.collection_etag = etag
+            return
+        self.seq = seq
+        self.state[href] = (etag, seq, timestamp)
+        self._seqs.append(seq)
+        self._hrefs.append(href)
+
+    def has_expired(self, max_age):
+        """Check for deleted items that are older than ``max_age``."""
+        age_limit = time.time() - max_age
+        return any(not etag and timestamp < age_limit
+                   for etag, _, timestamp in self.state.values())
+
+    def compact(self, max_age):
+        """Drop obsolete changes and return the remaining records."""
+        age_limit = time.time() - max_age
+        for href, (etag, seq, timestamp) in list(self.state.items()):
+            if not etag and timestamp < age_limit:
+                logger.debug("Found expired item in journal: %r", href)
+                del self.state[href]
+                self.base = max(self.base, seq)
+        records = sorted(
+            ((seq, href, etag, timestamp) for href, (etag, seq, timestamp)
+             in self.state.items()), key=lambda record: record[0])
+        self._seqs = [record[0] for record in records]
+        self._hrefs = [record[1] for record in records]
+        return records
+
+    def is_current(self, collection_etag):
+        return (self.id is not None and self.complete and
+                self.collection_etag == collection_etag)
+
+    def changes(self, seq=None, limit=None):
+        """Get the hrefs that changed after ``seq``.
+
+        The hrefs are ordered by their last change, deleted items are
+        skipped if ``seq`` is ``None``. At most ``limit`` (a positive
+        number) hrefs are returned.
+
+        Returns the hrefs and the sequence number of the last returned
+        change.
+
+        """
+        start = 0 if seq is None else bisect.bisect_right(self._seqs, seq)
+        last_seqs = {}
+        for i in range(len(self._hrefs) - 1, start - 1, -1):
+            last_seqs.setdefault(self._hrefs[i], self._seqs[i])
+        hrefs = sorted(last_seqs, key=last_seqs.__getitem__)
+        if seq is None:
+            hrefs = [href for href in hrefs if self.state[href][0]]
+        if limit is not None and len(hrefs) > limit:
+            del hrefs[limit:]
+            return hrefs, last_seqs[hrefs[-1]]
+        return hrefs, self.seq
+
+
+class CollectionJournalMixin:
+    """Record the changes of the items in a collection for synchronization.
+
+    The journal is only valid for the etag of the collection, otherwise
+    it's reconciled with the items. It's synced like the items.
+
+    """
+
+    @property
+    def _journal_path(self):
+        return os.path.join(self._filesystem_path, ".CDserver.cache",
+                            "journal")
+
+    def _get_journal(self):
+        return self._storage._journal_cache.setdefault(
+            self._filesystem_path, Journal())
+
+    def _write_journal(self, journal, changes, collection_etag):
+        """Add ``changes`` of hrefs and etags to ``journal``.
+
+        ``journal.lock`` must be held and the storage must be locked
+        exclusively or the cache lock ``journal`` must be held.
+
+        """
+        timestamp = int(time.time())
+        seq = journal.seq
+        records = []
+        for href, etag in changes:
+            seq += 1
+            records.append((seq, href, etag, timestamp))
+        records.append((seq, None, collection_etag, timestamp))
+        try:
+            if (journal.id is not None and journal.complete and
+                    journal.records + len(records) <=
+                    2 * len(journal.state) + COMPACT_SLACK):
+                with open(self._journal_path, "ab") as f:
+                    journal.append(f, records)
+                    f.flush()
+                    self._storage._fsync_deferrable(f)
+                return
+            if journal.id is None:
+                journal.clear()
+                journal.id = binascii.hexlify(os.urandom(16)).decode()
+            for record in records:
+                journal.apply(record)
+            self._rewrite_journal(journal)
+        except PermissionError:
+            pass
+
+    def _rewrite_journal(self, journal):
+        records = journal.compact(self._storage.configuration.get(
+            "storage", "max_sync_token_age"))
+        records.append((journal.seq, None, journal.collection_etag,
+                        int(time.time())))
+        cache_folder = os.path.dirname(self._journal_path)
+        self._storage._makedirs_synced(cache_folder)
+        # Older versions stored the history of items and the state of
+        # sync tokens in separate files
+        for name in ("history", "sync-token"):
+            shutil.rmtree(os.path.join(cache_folder, name),
+                          ignore_errors=True)
+        with self._atomic_write(self._journal_path, "wb") as f:
+            journal.rewrite(f, (journal.id, journal.base), records)
+        journal.set_ino(os.stat(self._journal_path).st_ino)
+
+    def _update_journal(self, old_etag, etag, items):
+        """Add the changes of ``items`` to the journal of ``old_etag``.
+
+        ``items`` are pairs of hrefs and the new items (``None`` for deleted
+        items). Nothing happens if the journal doesn't belong to
+        ``old_etag``, it's updated when it's used.
+
+        """
+        journal = self._get_journal()
+        with journal.lock:
+            journal.refresh(self._journal_path)
+            if not journal.is_current(old_etag):
+                return
+            self._write_journal(journal, [
+                (href, item.etag if item else "") for href, item in items],
+                etag)
+
+    def _reconcile_journal(self, journal, etags, collection_etag):
+        changes = [(href, "") for href, (etag, _, _) in journal.state.items()
+                   if etag and href not in etags]
+        for href, etag in etags.items():
+            state = journal.state.get(href)
+            if state is None or state[0] != etag:
+                changes.append((href, etag))
+        self._write_journal(journal, changes, collection_etag)
+
+    def _get_current_journal(self):
+        """Get the journal with all changes of the collection."""
+        collection_etag = self.etag
+        journal = self._get_journal()
+        with journal.lock:
+            journal.refresh(self._journal_path)
+            if journal.is_current(collection_etag):
+                return journal
+        with self._acquire_cache_lock("journal"):
+            etags = {item.href: item.etag for item in self.get_all()}
+            with journal.lock:
+                journal.refresh(self._journal_path)
+                if not journal.is_current(collection_etag):
+                    self._reconcile_journal(journal, etags, collection_etag)
+                    # Readers hand out sync tokens before the end of the
+                    # request
+                    self._storage._sync_deferred()
+        return journal
@@ -1,68 +1,158 @@
 import contextlib
-import logging
 import os
-import shlex
-import signal
-import subprocess
+import threading
 
 from CDserver import pathutils
 from CDserver.log import logger
+from CDserver.storage.multifilesystem.hook import HookRunner
 
 
 class CollectionLockMixin:
+    def __init__(self):
+        super().__init__()
+        self._storage._lock_owner_for_reading(self.path)
+
+    @property
+    def _locked(self):
+        """The mode in which the storage is locked for the collection."""
+        return self._storage._get_locked(self.path)
+
     def _acquire_cache_lock(self, ns=""):
-        if self._storage._lock.locked == "w":
+        if self._locked == "w":
             return contextlib.ExitStack()
         cache_folder = os.path.join(self._filesystem_path, ".CDserver.cache")
         self._storage._makedirs_synced(cache_folder)
         lock_path = os.path.join(cache_folder,
                                  ".CDserver.lock" + (".%s" % ns if ns else ""))
-        lock = pathutils.RwLock(lock_path)
-        return lock.acquire("w")
+        # The lock is closed after use, the collection can be deleted
+        return self._storage._acquire_rw_lock(lock_path, "w", keep=False)
 
 
 class StorageLockMixin:
+    """Lock the storage for requests.
+
+    Requests that only access the collections of one principal lock the
+    storage shared and the principal exclusively for changes. Other
+    requests lock the whole storage in the requested mode, requests that
+    only read lock each principal shared when they use its collections.
+
+    """
 
     def __init__(self, configuration):
         super().__init__(configuration)
         folder = self.configuration.get("storage", "filesystem_folder")
         lock_path = os.path.join(folder, ".CDserver.lock")
         self._lock = pathutils.RwLock(lock_path)
+        # Locks and the number of their users by path
+        self._rw_locks = {}
+        self._rw_locks_lock = threading.Lock()
+        # Locks of the current thread (see ``_acquire_lock``)
+        self._thread_locks = threading.local()
+        hook = self.configuration.get("storage", "hook")
+        self._hook_runner = HookRunner(
+            hook, folder, self.configuration.get("storage", "hook_delay")
+        ) if hook else None
+
+    @contextlib.contextmanager
+    def _acquire_rw_lock(self, path, mode, keep=True):
+        """Acquire the lock file ``path`` for the threads of the process.
+
+        Locks are kept open for the life of the process, unless ``keep`` is
+        false. Then they are forgotten when they aren't used anymore.
+
+        """
+        with self._rw_locks_lock:
+            lock, users = self._rw_locks.get(path, (None, 0))
+            if lock is None:
+                lock = pathutils.RwLock(path, keep_open=keep)
+            self._rw_locks[path] = (lock, users + 1)
+        try:
+            with lock.acquire(mode):
+                yield
+        finally:
+            with self._rw_locks_lock:
+                lock, users = self._rw_locks.pop(path)
+                if users > 1 or keep:
+                    self._rw_locks[path] = (lock, users - 1)
+
+    @staticmethod
+    def _get_owner(path):
+        owner = pathutils.strip_path(pathutils.sanitize_path(path)).split(
+            "/", maxsplit=1)[0]
+        if pathutils.is_safe_filesystem_path_component(owner):
+            return owner
+        return None
+
+    def _acquire_owner_lock(self, owner, mode):
+        lock_path = os.path.join(self.configuration.get(
+            "storage", "filesystem_folder"), ".CDserver.locks", owner)
+        self._makedirs_synced(os.path.dirname(lock_path))
+        return self._acquire_rw_lock(lock_path, mode)
+
+    def _get_locked(self, path):
+        """Get the mode in which the current thread locked ``path``."""
+        modes = getattr(self._thread_locks, "modes", None)
+        if not modes:
+            return ""
+        if modes[None] == "w":
+            return "w"
+        owner = self._get_owner(path)
+        if owner is None:
+            # Collections without owner are only changed with the storage
+            # locked exclusively
+            return "r"
+        return modes.get(owner, "")
+
+    def _lock_owner_for_reading(self, path):
+        """Lock the principal of ``path`` if the request reads the
+        collections of several principals.
+
+        The locks are released with the storage.
+
+        """
+        stack = getattr(self._thread_locks, "stack", None)
+        owner = self._get_owner(path)
+        if stack is None or owner is None:
+            return
+        modes = self._thread_locks.modes
+        if owner not in modes:
+            stack.enter_context(self._acquire_owner_lock(owner, "r"))
+            modes[owner] = "r"
+
+    @contextlib.contextmanager
+    def _acquire_lock(self, mode, paths=None):
+        owners = {self._get_owner(path) for path in paths or ()}
+        with contextlib.ExitStack() as stack:
+            if len(owners) == 1 and None not in owners:
+                owner, = owners
+                stack.enter_context(self._lock.acquire("r"))
+                stack.enter_context(self._acquire_owner_lock(owner, mode))
+                modes = {None: "r", owner: mode}
+            else:
+                stack.enter_context(self._lock.acquire(mode))
+                modes = {None: mode}
+            self._thread_locks.modes = modes
+            # Only readers lock principals when they are used, a writer of
+            # one principal never waits for another one
+            self._thread_locks.stack = (
+                stack if len(modes) == 1 and mode == "r" else None)
+            try:
+                yield
+            finally:
+                self._thread_locks.modes = None
+                self._thread_locks.stack = None
+
+    def close(self):
+        """Run the pending storage hooks."""
+        if self._hook_runner:
+            self._hook_runner.close()
+        super().close()
 
     @contextlib.contextmanager
-    def acquire_lock(self, mode, user=None):
-        with self._lock.acquire(mode):
+    def acquire_lock(self, mode, user=None, paths=None):
+        self._start_maintenance()
+        with self._acquire_lock(mode, paths), self._defer_syncs():
             yield
-            hook = self.configuration.get("storage", "hook")
-            if mode == "w" and hook:
-                folder = self.configuration.get("storage", "filesystem_folder")
-                debug = logger.isEnabledFor(logging.DEBUG)
-                popen_kwargs = dict(
-                    stdin=subprocess.DEVNULL,
-                    stdout=subprocess.PIPE if debug else subprocess.DEVNULL,
-                    stderr=subprocess.PIPE if debug else subprocess.DEVNULL,
-                    shell=True, universal_newlines=True, cwd=folder)
-                if os.name == "posix":
-                    popen_kwargs["preexec_fn"] = os.setpgrp
-                elif os.name == "nt":
-                    popen_kwargs["creationflags"] = (
-                        subprocess.CREATE_NEW_PROCESS_GROUP)
-                command = hook % {"user": shlex.quote(user or "Anonymous")}
-                logger.debug("Running storage hook")
-                p = subprocess.Popen(command, **popen_kwargs)
-                try:
-                    stdout_data, stderr_data = p.communicate()
-                except BaseException:
-                    p.kill()
-                    p.wait()
-                    raise
-                finally:
-                    if os.name == "posix":
-                        with contextlib.suppress(OSError):
-                            os.killpg(p.pid, signal.SIGKILL)
-                if stdout_data:
-                    logger.debug("Captured stdout from hook:\n%s", stdout_data)
-                if stderr_data:
-                    logger.debug("Captured stderr from hook:\n%s", stderr_data)
-                if p.returncode != 0:
-                    raise subprocess.CalledProcessError(p.returncode, p.args)
+            logger.debug("Memory cache: %r", self._memory_cache)
+            if mode == "w" and self._hook_runner:
+                self._hook_runner.schedule(user)
@@ -0,0 +1,188 @@
+import os
+import posixpath
+import shutil
+import threading
+import time
+
+import fcntl
+
+from CDserver import pathutils
+from CDserver.log import logger
+from CDserver.storage.multifilesystem.records import COMPACT_SLACK
+from CDserver.storage.multifilesystem.snapshot import clean_versions
+
+# Temporary files of interrupted writes are removed after this number of
+# seconds
+TMP_MAX_AGE = 3600
+# Items are checked in batches of this size, the lock of the storage is
+# released between the batches
+ITEM_BATCH_SIZE = 100
+
+
+def _has_garbage(records, entries):
+    """Check if a file is halfway to being compacted during writes."""
+    return records - entries > (entries + COMPACT_SLACK) // 2
+
+
+class CollectionMaintenanceMixin:
+    def _maintain(self):
+        """Compact the caches of the collection and remove stale files.
+
+        The storage must be locked.
+
+        """
+        index = self._get_item_index_object()
+        with index.lock:
+            index.refresh(self._item_index_path)
+            compact = not index.complete or _has_garbage(
+                index.records, len(index.entries))
+        if compact:
+            with self._acquire_cache_lock("item"):
+                logger.debug("Compacting item index of %r", self.path)
+                with index.lock:
+                    index.refresh(self._item_index_path)
+                    self._rewrite_item_index(index, [])
+        journal = self._get_journal()
+        with journal.lock:
+            journal.refresh(self._journal_path)
+            compact = journal.id is not None and journal.complete and (
+                _has_garbage(journal.records, len(journal.state)) or
+                journal.has_expired(self._storage.configuration.get(
+                    "storage", "max_sync_token_age")))
+        if compact:
+            with self._acquire_cache_lock("journal"):
+                logger.debug("Compacting journal of %r", self.path)
+                with journal.lock:
+                    journal.refresh(self._journal_path)
+                    if journal.id is not None and journal.complete:
+                        self._rewrite_journal(journal)
+        self._clean_versions()
+        age_limit = time.time() - TMP_MAX_AGE
+        for folder in (self._filesystem_path,
+                       os.path.join(self._filesystem_path, ".CDserver.cache")):
+            try:
+                entries = list(os.scandir(folder))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.name.startswith(".CDserver.tmp-"):
+                    continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime > age_limit:
+                        continue
+                except FileNotFoundError:
+                    continue
+                logger.debug("Removing stale temporary file %r", entry.path)
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def _maintain_items(self, hrefs):
+        """Find items that were edited in place.
+
+        Loading the items checks them against the item index. The storage
+        must be locked.
+
+        """
+        for href in hrefs:
+            self._get(href, verify_href=False)
+
+
+class StorageMaintenanceMixin:
+    """Run the maintenance of collections in a background thread.
+
+    Each run checks up to ``maintenance_budget`` collections, only one
+    thread of all processes runs at a time.
+
+    """
+
+    def __init__(self, configuration):
+        super().__init__(configuration)
+        self._maintenance_pid = None
+        # Remaining paths and filesystem paths of collections
+        self._maintenance_queue = []
+
+    def _start_maintenance(self):
+        interval = self.configuration.get("storage", "maintenance_interval")
+        if not interval or self._maintenance_pid == os.getpid():
+            return
+        self._maintenance_pid = os.getpid()
+        threading.Thread(target=self._run_maintenance, args=(interval,),
+                         name="Maintenance", daemon=True).start()
+
+    def _run_maintenance(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error("Storage maintenance failed: %s", e,
+                             exc_info=True)
+
+    def _get_maintenance_collection(self, sane_path, filesystem_path):
+        return self._collection_class(
+            self, pathutils.unstrip_path(sane_path, True),
+            filesystem_path=filesystem_path)
+
+    def maintain(self, budget=None):
+        """Check the next ``budget`` collections.
+
+        Returns ``False`` if the maintenance is already running.
+
+        """
+        if budget is None:
+            budget = self.configuration.get("storage", "maintenance_budget")
+        folder = self.configuration.get("storage", "filesystem_folder")
+        lock_path = os.path.join(folder, ".CDserver.lock.maintenance")
+        with open(lock_path, "w+") as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(),
+                            fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.debug("Storage maintenance is already running")
+                return False
+            if not self._maintenance_queue:
+                clean_versions(self._versions_folder)
+                self._maintenance_queue.append(
+                    ("", self._get_collection_root_folder()))
+            start = time.monotonic()
+            count = 0
+            while self._maintenance_queue and count < budget:
+                sane_path, filesystem_path = self._maintenance_queue.pop(0)
+                count += 1
+                with self._acquire_lock("r", [sane_path]):
+                    if not os.path.isdir(filesystem_path):
+                        continue
+                    collection = self._get_maintenance_collection(
+                        sane_path, filesystem_path)
+                    try:
+                        collection._maintain()
+                    except Exception as e:
+                        logger.error("Maintenance of collection %r failed: "
+                                     "%s", sane_path, e, exc_info=True)
+                    hrefs, children = collection._scan()
+                    hrefs = list(hrefs)
+                for i in range(0, len(hrefs), ITEM_BATCH_SIZE):
+                    with self._acquire_lock("r", [sane_path]):
+                        if not os.path.isdir(filesystem_path):
+                            break
+                        collection = self._get_maintenance_collection(
+                            sane_path, filesystem_path)
+                        try:
+                            collection._maintain_items(
+                                hrefs[i:i + ITEM_BATCH_SIZE])
+                        except Exception as e:
+                            logger.error("Maintenance of items in collection "
+                                         "%r failed: %s", sane_path, e,
+                                         exc_info=True)
+                self._maintenance_queue.extend(
+                    (posixpath.join(sane_path, href),
+                     os.path.join(filesystem_path, href))
+                    for href in children)
+            logger.debug("Checked %d collections in %.3f seconds", count,
+                         time.monotonic() - start)
+        return True
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+
+# Estimated size of a cached entry without the text
+ENTRY_SIZE = 512
+
+
+class MemoryCache:
+    """Least recently used items of all collections.
+
+    Values are index entries and optionally the text of the items. The
+    cache is limited by the number of items and by the estimated size of
+    the values.
+
+    """
+
+    def __init__(self, max_items, max_size):
+        self.max_items = max_items
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return "<%s: %d items, %d bytes, %d hits, %d misses>" % (
+            type(self).__name__, len(self), self._size, self.hits,
+            self.misses)
+
+    @staticmethod
+    def _value_size(value):
+        _, text = value
+        return ENTRY_SIZE + (len(text) if text else 0)
+
+    def get(self, key):
+        if not self.max_items:
+            return None
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._values.move_to_end(key)
+            return value
+
+    def put(self, key, entry, text=None):
+        if not self.max_items:
+            return
+        value = (entry, text)
+        size = self._value_size(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            old_value = self._values.pop(key, None)
+            if old_value is not None:
+                self._size -= self._value_size(old_value)
+            self._values[key] = value
+            self._size += size
+            while (len(self._values) > self.max_items or
+                   self._size > self.max_size):
+                _, old_value = self._values.popitem(last=False)
+                self._size -= self._value_size(old_value)
+
+
+class CollectionCache:
+    """Least recently used values of collections by filesystem path.
+
+    The cache is limited by the number of collections, values of
+    collections that weren't used recently are dropped.
+
+    """
+
+    def __init__(self, max_collections):
+        self.max_collections = max_collections
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return "<%s: %d collections>" % (type(self).__name__, len(self))
+
+    def get(self, path):
+        with self._lock:
+            value = self._values.get(path)
+            if value is not None:
+                self._values.move_to_end(path)
+            return value
+
+    def __setitem__(self, path, value):
+        with self._lock:
+            self._put(path, value)
+
+    def setdefault(self, path, value):
+        with self._lock:
+            old_value = self._values.get(path)
+            if old_value is not None:
+                self._values.move_to_end(path)
+                return old_value
+            self._put(path, value)
+            return value
+
+    def pop(self, path, default=None):
+        with self._lock:
+            return self._values.pop(path, default)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _put(self, path, value):
+        if not self.max_collections:
+            return
+        self._values[path] = value
+        self._values.move_to_end(path)
+        while len(self._values) > self.max_collections:
+            self._values.popitem(last=False)
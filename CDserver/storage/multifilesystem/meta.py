@@ -2,6 +2,7 @@ import json
 import os
 
 from CDserver import item as CDserver_item
+from CDserver.storage.multifilesystem.ctag import is_racy
 
 
 class CollectionMetaMixin:
@@ -11,20 +12,37 @@ class CollectionMetaMixin:
         self._props_path = os.path.join(
             self._filesystem_path, ".CDserver.props")
 
-    def get_meta(self, key=None):
-        if self._storage._lock.locked == "w" or self._meta_cache is None:
+    def _load_meta(self):
+        try:
+            stat = os.stat(self._props_path)
+        except FileNotFoundError:
+            stat = None
+        stamp = stat and (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        cached = self._storage._meta_cache.get(self._props_path)
+        if cached and cached[0] == stamp:
+            return dict(cached[1])
+        try:
             try:
-                try:
-                    with open(self._props_path, encoding=self._encoding) as f:
-                        self._meta_cache = json.load(f)
-                except FileNotFoundError:
-                    self._meta_cache = {}
-                CDserver_item.check_and_sanitize_props(self._meta_cache)
-            except ValueError as e:
-                raise RuntimeError("Failed to load properties of collection "
-                                   "%r: %s" % (self.path, e)) from e
+                with open(self._props_path, encoding=self._encoding) as f:
+                    meta = json.load(f)
+            except FileNotFoundError:
+                meta = {}
+            CDserver_item.check_and_sanitize_props(meta)
+        except ValueError as e:
+            raise RuntimeError("Failed to load properties of collection "
+                               "%r: %s" % (self.path, e)) from e
+        if stat is None or not is_racy(stat.st_mtime_ns):
+            self._storage._meta_cache[self._props_path] = (stamp, dict(meta))
+        return meta
+
+    def get_meta(self, key=None):
+        if self._locked == "w" or self._meta_cache is None:
+            self._meta_cache = self._load_meta()
         return self._meta_cache.get(key) if key else self._meta_cache
 
     def set_meta(self, props):
+        ctag_state = self._get_ctag_state()
+        self._storage._meta_cache.pop(self._props_path, None)
         with self._atomic_write(self._props_path, "w") as f:
             json.dump(props, f, sort_keys=True)
+        self._update_ctag_state(ctag_state, props=props)
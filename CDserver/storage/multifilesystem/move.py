@@ -8,6 +8,10 @@ class StorageMoveMixin:
     def move(self, item, to_collection, to_href):
         if not pathutils.is_safe_filesystem_path_component(to_href):
             raise pathutils.UnsafePathError(to_href)
+        ctag_state = item.collection._get_ctag_state()
+        to_ctag_state = to_collection._get_ctag_state()
+        item.collection._preserve_versions([item.href])
+        to_collection._preserve_versions([to_href])
         os.replace(
             pathutils.path_to_filesystem(
                 item.collection._filesystem_path, item.href),
@@ -16,22 +20,20 @@ class StorageMoveMixin:
         self._sync_directory(to_collection._filesystem_path)
         if item.collection._filesystem_path != to_collection._filesystem_path:
             self._sync_directory(item.collection._filesystem_path)
-        cache_folder = os.path.join(item.collection._filesystem_path,
-                                    ".CDserver.cache", "item")
-        to_cache_folder = os.path.join(to_collection._filesystem_path,
-                                       ".CDserver.cache", "item")
-        self._makedirs_synced(to_cache_folder)
-        try:
-            os.replace(os.path.join(cache_folder, item.href),
-                       os.path.join(to_cache_folder, to_href))
-        except FileNotFoundError:
-            pass
+        # The file keeps its metadata, the cache entry stays valid
+        entry = item.collection._get_item_index().get(item.href)
+        if item.collection._filesystem_path != to_collection._filesystem_path:
+            item.collection._update_item_index([(item.href, None)])
+            if entry is not None:
+                to_collection._update_item_index([(to_href, entry)])
         else:
-            self._makedirs_synced(to_cache_folder)
-            if cache_folder != to_cache_folder:
-                self._makedirs_synced(cache_folder)
-        to_collection._update_history_etag(to_href, item)
-        item.collection._update_history_etag(item.href, None)
-        to_collection._clean_history()
+            to_collection._update_item_index(
+                [(item.href, None)] +
+                ([(to_href, entry)] if entry is not None else []))
         if item.collection._filesystem_path != to_collection._filesystem_path:
-            item.collection._clean_history()
+            item.collection._update_ctag_state(
+                ctag_state, [(item.href, None)])
+            to_collection._update_ctag_state(to_ctag_state, [(to_href, item)])
+        else:
+            to_collection._update_ctag_state(
+                ctag_state, [(item.href, None), (to_href, item)])
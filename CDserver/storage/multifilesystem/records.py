@@ -0,0 +1,105 @@
+import os
+import pickle
+import threading
+
+# Files are rewritten when they contain more than this number of records
+# plus twice the number of entries
+COMPACT_SLACK = 64
+
+
+class RecordFile:
+    """In-memory state of a file of pickled records.
+
+    The file starts with a header, followed by records. New records are
+    appended and the records that were appended by other processes are
+    read incrementally. The file is rewritten to drop obsolete records.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self, ino=None):
+        self.records = 0
+        self.complete = True
+        self._ino = ino
+        self._offset = 0
+        self.clear()
+
+    def clear(self):
+        """Reset the state that is derived from the records."""
+        raise NotImplementedError
+
+    def read_header(self, header):
+        """Check the header of the file.
+
+        Returns ``False`` if the records can't be used.
+
+        """
+        raise NotImplementedError
+
+    def apply(self, record):
+        raise NotImplementedError
+
+    def refresh(self, path):
+        """Read the records that were appended to ``path``."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        if stat.st_ino != self._ino or stat.st_size < self._offset:
+            self._reset(stat.st_ino)
+        if stat.st_size == self._offset:
+            return
+        with open(path, "rb") as f:
+            if self._offset == 0:
+                try:
+                    header = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError, ValueError,
+                        TypeError):
+                    header = None
+                if header is None or not self.read_header(header):
+                    self.complete = False
+                    return
+                self._offset = f.tell()
+            f.seek(self._offset)
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    self.complete = True
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError):
+                    # The last record is incomplete, it's still being
+                    # written or the server crashed while writing it
+                    self.complete = False
+                    break
+                self._offset = f.tell()
+                self.records += 1
+                self.apply(record)
+
+    def append(self, f, records):
+        data = b"".join(pickle.dumps(record) for record in records)
+        f.write(data)
+        self._offset += len(data)
+        self.records += len(records)
+        for record in records:
+            self.apply(record)
+
+    def rewrite(self, f, header, records):
+        """Write ``header`` and ``records`` to the empty file ``f``.
+
+        The records must already be applied.
+
+        """
+        data = pickle.dumps(header) + b"".join(
+            pickle.dumps(record) for record in records)
+        f.write(data)
+        self._offset = len(data)
+        self.records = len(records)
+        self.complete = True
+
+    def set_ino(self, ino):
+        self._ino = ino
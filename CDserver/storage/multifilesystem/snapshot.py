@@ -0,0 +1,118 @@
+import os
+import posixpath
+import time
+
+from CDserver import pathutils
+from CDserver.log import logger
+
+# Replaced versions of items are kept for this number of seconds, reading
+# a snapshot must not take longer
+VERSION_MAX_AGE = 3600
+
+
+def clean_versions(folder, max_age=VERSION_MAX_AGE):
+    age_limit = time.time() - max_age
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            # The change time is updated when the link is created
+            if entry.stat(follow_symlinks=False).st_ctime > age_limit:
+                continue
+            logger.debug("Removing expired version %r in %r", entry.name,
+                         folder)
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+class CollectionSnapshotMixin:
+    """Keep replaced versions of items by the hash of their content, for
+    readers that load the text after the storage was unlocked."""
+
+    @property
+    def _versions_folder(self):
+        return os.path.join(self._filesystem_path, ".CDserver.cache",
+                            "versions")
+
+    def _preserve_versions(self, hrefs, versions_folder=None):
+        """Keep the current versions of the items ``hrefs``.
+
+        Must be called before the items are replaced or deleted.
+
+        """
+        if versions_folder is None:
+            versions_folder = self._versions_folder
+        entries = self._get_item_index(refresh=True)
+        folder_created = False
+        for href in hrefs:
+            entry = entries.get(href)
+            if entry is None:
+                # The item was never read, it's not part of a snapshot
+                continue
+            if not folder_created:
+                self._storage._makedirs_synced(versions_folder)
+                folder_created = True
+            self._link_version(os.path.join(self._filesystem_path, href),
+                               os.path.join(versions_folder, entry[0].hex()))
+
+    @staticmethod
+    def _link_version(path, version_path):
+        try:
+            os.link(path, version_path)
+        except FileExistsError:
+            # Renew the version with the same content
+            os.utime(version_path)
+        except FileNotFoundError:
+            pass
+
+    def _preserve_all_versions(self):
+        """Keep the versions of the collection and its children in the
+        storage before the collection is replaced or deleted."""
+        versions_folder = self._storage._versions_folder
+        self._preserve_versions(self._list(), versions_folder)
+        try:
+            entries = list(os.scandir(self._versions_folder))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            self._link_version(entry.path,
+                               os.path.join(versions_folder, entry.name))
+        _, children = self._scan()
+        for child in children:
+            self._storage._collection_class(
+                self._storage, pathutils.unstrip_path(
+                    posixpath.join(self.path, child), True),
+                filesystem_path=os.path.join(self._filesystem_path, child)
+            )._preserve_all_versions()
+
+    def _read_version(self, cache_hash):
+        """Read the content of a replaced item by the hash of its content.
+
+        The content is checked, it could have been overwritten.
+
+        """
+        for folder in (self._versions_folder,
+                       self._storage._versions_folder):
+            try:
+                with open(os.path.join(folder, cache_hash.hex()), "rb") as f:
+                    raw_text = f.read()
+            except FileNotFoundError:
+                continue
+            if self._item_cache_hash(raw_text) == cache_hash:
+                return raw_text
+        raise RuntimeError("The item was replaced and its previous "
+                           "version is no longer available")
+
+    def _clean_versions(self, max_age=VERSION_MAX_AGE):
+        clean_versions(self._versions_folder, max_age)
+
+
+class StorageSnapshotMixin:
+    @property
+    def _versions_folder(self):
+        """Versions of the items of replaced and deleted collections."""
+        return os.path.join(self.configuration.get(
+            "storage", "filesystem_folder"), ".CDserver.versions")
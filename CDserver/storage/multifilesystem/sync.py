@@ -1,82 +1,29 @@
-import itertools
-import os
-import pickle
-from hashlib import sha256
-
-from CDserver.log import logger
+TOKEN_PREFIX = "http://CDserver.org/ns/sync/"
 
 
 class CollectionSyncMixin:
     def sync(self, old_token=None):
-        def check_token_name(token_name):
-            if len(token_name) != 64:
-                return False
-            for c in token_name:
-                if c not in "0123456789abcdef":
-                    return False
-            return True
+        token, changes, _ = self.sync_page(old_token)
+        return token, changes
 
-        old_token_name = None
+    def sync_page(self, old_token=None, limit=None):
+        old_journal_id = old_seq = None
         if old_token:
-            if not old_token.startswith("http://CDserver.org/ns/sync/"):
+            if not old_token.startswith(TOKEN_PREFIX):
                 raise ValueError("Malformed token: %r" % old_token)
-            old_token_name = old_token[len("http://CDserver.org/ns/sync/"):]
-            if not check_token_name(old_token_name):
+            old_journal_id, _, old_seq = old_token[
+                len(TOKEN_PREFIX):].partition("-")
+            if (len(old_journal_id) != 32 or not old_seq or
+                    not all(c in "0123456789abcdef" for c in old_journal_id)
+                    or not all(c in "0123456789" for c in old_seq)):
                 raise ValueError("Malformed token: %r" % old_token)
-        state = {}
-        token_name_hash = sha256()
-        for href, item in itertools.chain(
-                ((item.href, item) for item in self.get_all()),
-                ((href, None) for href in self._get_deleted_history_hrefs())):
-            history_etag = self._update_history_etag(href, item)
-            state[href] = history_etag
-            token_name_hash.update((href + "/" + history_etag).encode())
-        token_name = token_name_hash.hexdigest()
-        token = "http://CDserver.org/ns/sync/%s" % token_name
-        if token_name == old_token_name:
-            return token, ()
-        token_folder = os.path.join(self._filesystem_path,
-                                    ".CDserver.cache", "sync-token")
-        token_path = os.path.join(token_folder, token_name)
-        old_state = {}
-        if old_token_name:
-            old_token_path = os.path.join(token_folder, old_token_name)
-            try:
-                with open(old_token_path, "rb") as f:
-                    old_state = pickle.load(f)
-            except (FileNotFoundError, pickle.UnpicklingError,
-                    ValueError) as e:
-                if isinstance(e, (pickle.UnpicklingError, ValueError)):
-                    logger.warning(
-                        "Failed to load stored sync token %r in %r: %s",
-                        old_token_name, self.path, e, exc_info=True)
-                    try:
-                        os.remove(old_token_path)
-                    except (FileNotFoundError, PermissionError):
-                        pass
+            old_seq = int(old_seq)
+        journal = self._get_current_journal()
+        with journal.lock:
+            if old_journal_id is not None and (
+                    old_journal_id != journal.id or
+                    not journal.base <= old_seq <= journal.seq):
                 raise ValueError("Token not found: %r" % old_token)
-        if not os.path.exists(token_path):
-            self._storage._makedirs_synced(token_folder)
-            try:
-                with self._atomic_write(token_path, "wb") as f:
-                    pickle.dump(state, f)
-            except PermissionError:
-                pass
-            else:
-                self._clean_cache(token_folder, os.listdir(token_folder),
-                                  max_age=self._storage.configuration.get(
-                                      "storage", "max_sync_token_age"))
-                self._clean_history()
-        else:
-            try:
-                os.utime(token_path)
-            except FileNotFoundError:
-                pass
-        changes = []
-        for href, history_etag in state.items():
-            if history_etag != old_state.get(href):
-                changes.append(href)
-        for href, history_etag in old_state.items():
-            if href not in state:
-                changes.append(href)
-        return token, changes
+            changes, seq = journal.changes(old_seq, limit)
+            token = "%s%s-%d" % (TOKEN_PREFIX, journal.id, seq)
+            return token, changes, seq == journal.seq
@@ -0,0 +1,139 @@
+import os
+
+from CDserver import storage
+from CDserver.log import logger
+from CDserver.storage.multifilesystem.records import (COMPACT_SLACK,
+                                                      RecordFile)
+
+
+class UidIndex(RecordFile):
+    """UIDs of the items of a collection by href.
+
+    The file ``.CDserver.cache/uids`` starts with the cache version,
+    followed by records of hrefs and UIDs (``None`` for deleted items).
+    Records without href contain the etag of the collection after the
+    preceding changes.
+
+    """
+
+    def clear(self):
+        self.collection_etag = None
+        self.by_href = {}
+        # Number of items by UID, UIDs aren't unique
+        self.uids = {}
+
+    def read_header(self, header):
+        return header == storage.CACHE_VERSION
+
+    def apply(self, record):
+        href, uid = record
+        if href is None:
+            self.collection_etag = uid
+            return
+        old_uid = self.by_href.pop(href, None)
+        if old_uid is not None:
+            self.uids[old_uid] -= 1
+            if not self.uids[old_uid]:
+                del self.uids[old_uid]
+        if uid is not None:
+            self.by_href[href] = uid
+            self.uids[uid] = self.uids.get(uid, 0) + 1
+
+    def is_current(self, collection_etag):
+        return self.complete and self.collection_etag == collection_etag
+
+
+class CollectionUidIndexMixin:
+    """Look up the UIDs of the items in a collection.
+
+    The index is only valid for the etag of the collection. It's updated by
+    the storage operations and rebuilt from all items otherwise.
+
+    """
+
+    @property
+    def _uid_index_path(self):
+        return os.path.join(self._filesystem_path, ".CDserver.cache", "uids")
+
+    def _get_uid_index_object(self):
+        return self._storage._uid_index_cache.setdefault(
+            self._filesystem_path, UidIndex())
+
+    def _store_uid_index(self, etag, by_href):
+        """Replace the index with the UIDs ``by_href`` for ``etag``.
+
+        ``index.lock`` must not be held.
+
+        """
+        index = self._get_uid_index_object()
+        with index.lock:
+            index.clear()
+            for href, uid in by_href.items():
+                index.apply((href, uid))
+            index.apply((None, etag))
+            self._rewrite_uid_index(index)
+
+    def _rewrite_uid_index(self, index):
+        cache_folder = os.path.dirname(self._uid_index_path)
+        self._storage._makedirs_synced(cache_folder)
+        try:
+            with self._atomic_write(self._uid_index_path, "wb",
+                                    cache=True) as f:
+                index.rewrite(f, storage.CACHE_VERSION, [
+                    *index.by_href.items(), (None, index.collection_etag)])
+        except PermissionError:
+            return
+        index.set_ino(os.stat(self._uid_index_path).st_ino)
+
+    def _get_uid_index(self):
+        """Get the index for the current etag of the collection."""
+        etag = self.etag
+        index = self._get_uid_index_object()
+        with index.lock:
+            index.refresh(self._uid_index_path)
+            if index.is_current(etag):
+                return index
+        with self._acquire_cache_lock("uids"):
+            with index.lock:
+                index.refresh(self._uid_index_path)
+                if index.is_current(etag):
+                    return index
+            logger.debug("Building UID index of %r", self.path)
+            self._store_uid_index(
+                etag, {item.href: item.uid for item in self.get_all()})
+        return index
+
+    def _update_uid_index(self, old_etag, etag, items):
+        """Append the changes of ``items`` to the index of ``old_etag``.
+
+        ``items`` are pairs of hrefs and the new items (``None`` for deleted
+        items). Nothing happens if the index doesn't belong to
+        ``old_etag``, it's rebuilt when required.
+
+        """
+        index = self._get_uid_index_object()
+        with index.lock:
+            index.refresh(self._uid_index_path)
+            if not index.is_current(old_etag):
+                return
+            records = [(href, item.uid if item else None)
+                       for href, item in items]
+            records.append((None, etag))
+            if (index.records + len(records) >
+                    2 * len(index.by_href) + COMPACT_SLACK):
+                for record in records:
+                    index.apply(record)
+                self._rewrite_uid_index(index)
+                return
+            try:
+                with open(self._uid_index_path, "ab") as f:
+                    index.append(f, records)
+                    f.flush()
+                    self._storage._fsync_cache(f)
+            except PermissionError:
+                pass
+
+    def has_uid(self, uid):
+        index = self._get_uid_index()
+        with index.lock:
+            return uid in index.uids
@@ -1,5 +1,4 @@
 import os
-import pickle
 
 from CDserver import item as CDserver_item
 from CDserver import pathutils
@@ -9,28 +8,32 @@ class CollectionUploadMixin:
     def upload(self, href, item):
         if not pathutils.is_safe_filesystem_path_component(href):
             raise pathutils.UnsafePathError(href)
+        ctag_state = self._get_ctag_state()
         try:
-            self._store_item_cache(href, item)
+            entry = self._item_cache_content(item)
         except Exception as e:
             raise ValueError("Failed to store item %r in collection %r: %s" %
                              (href, self.path, e)) from e
         path = pathutils.path_to_filesystem(self._filesystem_path, href)
+        self._preserve_versions([href])
+        text = item.serialize()
         with self._atomic_write(path, newline="") as fd:
-            fd.write(item.serialize())
-        self._clean_item_cache()
-        self._update_history_etag(href, item)
-        self._clean_history()
-        return self._get(href, verify_href=False)
+            fd.write(text)
+        self._update_item_index([(href, entry)])
+        self._update_ctag_state(ctag_state, [(href, item)])
+        # The stored item is known, only the modification time is missing
+        return self._make_item(href, path, os.stat(path), entry, text,
+                               vobject_item=item.vobject_item)
 
     def _upload_all_nonatomic(self, items, suffix=""):
-        cache_folder = os.path.join(self._filesystem_path,
-                                    ".CDserver.cache", "item")
-        self._storage._makedirs_synced(cache_folder)
+        ctag_state = self._get_ctag_state()
+        uploaded_items = []
+        index_records = []
         hrefs = set()
         for item in items:
             uid = item.uid
             try:
-                cache_content = self._item_cache_content(item)
+                entry = self._item_cache_content(item)
             except Exception as e:
                 raise ValueError(
                     "Failed to store item %r in temporary collection %r: %s" %
@@ -69,9 +72,10 @@ class CollectionUploadMixin:
                 f.flush()
                 self._storage._fsync(f)
             hrefs.add(href)
-            with open(os.path.join(cache_folder, href), "wb") as f:
-                pickle.dump(cache_content, f)
-                f.flush()
-                self._storage._fsync(f)
-        self._storage._sync_directory(cache_folder)
-        self._storage._sync_directory(self._filesystem_path)
+            uploaded_items.append((href, item))
+            index_records.append((href, entry))
+        self._update_item_index(index_records)
+        etag, _ = self._update_ctag_state(ctag_state, uploaded_items)
+        # The collection was empty
+        self._store_uid_index(etag, {href: item.uid
+                                     for href, item in uploaded_items})
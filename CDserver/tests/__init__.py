@@ -0,0 +1,54 @@
+"""
+Tests for CDserver.
+
+"""
+
+import io
+import shutil
+import sys
+import tempfile
+
+from CDserver import Application, config
+
+
+class BaseTest:
+    """Base class for tests of the application."""
+
+    def setup_method(self):
+        self.colpath = tempfile.mkdtemp()
+        self.configuration = config.load()
+        self.configuration.update({
+            "storage": {"filesystem_folder": self.colpath,
+                        # Disable syncing to disk for better performance
+                        "_filesystem_fsync": "False"}},
+            "test", privileged=True)
+        self.application = Application(self.configuration)
+
+    def teardown_method(self):
+        shutil.rmtree(self.colpath)
+
+    def request(self, method, path, data=None, **kwargs):
+        """Send a request and return the status, headers and answer."""
+        if isinstance(data, str):
+            data = data.encode()
+        data = data or b""
+        environ = {"REQUEST_METHOD": method, "PATH_INFO": path,
+                   "wsgi.input": io.BytesIO(data),
+                   "wsgi.errors": sys.stderr,
+                   "CONTENT_LENGTH": str(len(data)),
+                   "SERVER_NAME": "localhost", "SERVER_PORT": "80",
+                   "wsgi.url_scheme": "http"}
+        environ.update(kwargs)
+        status = headers = None
+
+        def start_response(status_, headers_):
+            nonlocal status, headers
+            status = int(status_.split()[0])
+            headers = dict(headers_)
+        answer = b"".join(self.application(environ, start_response))
+        return status, headers, answer
+
+
+def get_vcard(uid, name="Name"):
+    return ("BEGIN:VCARD\r\nVERSION:3.0\r\nUID:%s\r\nFN:%s\r\nN:%s;;;;\r\n"
+            "END:VCARD\r\n" % (uid, name, name))
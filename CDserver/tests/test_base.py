@@ -0,0 +1,171 @@
+"""
+Tests for the application.
+
+"""
+
+import base64
+import gzip
+import re
+
+import defusedxml.ElementTree as DefusedET
+
+from CDserver import Application, httputils
+from CDserver.tests import BaseTest, get_vcard
+
+
+class TestBase(BaseTest):
+
+    def setup_method(self):
+        super().setup_method()
+        status, _, _ = self.request("MKCOL", "/user/")
+        assert status == 201
+
+    def test_put(self):
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/", get_vcard("first"),
+            CONTENT_TYPE="text/vcard")
+        assert status == 201
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/card.vcf", get_vcard("card"),
+            CONTENT_TYPE="text/vcard")
+        assert status == 201
+        status, _, answer = self.request("GET", "/user/contacts/card.vcf")
+        assert status == 200
+        assert b"UID:card" in answer
+
+    def test_put_spooled_to_disk(self):
+        """Bodies larger than the spool size are stored in a file."""
+        cards = [get_vcard("card%d" % i, "Name %d " % i + "x" * 200)
+                 for i in range(2 * httputils.SPOOL_SIZE // 200)]
+        data = "".join(cards).encode()
+        assert len(data) > httputils.SPOOL_SIZE
+        status, _, _ = self.request(
+            "PUT", "/user/big/", gzip.compress(data),
+            CONTENT_TYPE="text/vcard", HTTP_CONTENT_ENCODING="gzip")
+        assert status == 201
+        status, _, answer = self.request("GET", "/user/big/")
+        assert status == 200
+        assert answer.count(b"BEGIN:VCARD") == len(cards)
+
+    def test_compressed_response_headers(self):
+        """Compressed and uncompressed answers vary by Accept-Encoding."""
+        cards = "".join(get_vcard("card%d" % i) for i in range(20))
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/", cards, CONTENT_TYPE="text/vcard")
+        assert status == 201
+        status, headers, answer = self.request(
+            "GET", "/user/contacts/", HTTP_ACCEPT_ENCODING="gzip")
+        assert status == 200
+        assert headers.get("Content-Encoding") == "gzip"
+        assert headers.get("Vary") == "Accept-Encoding"
+        assert len(answer) < 1024
+        assert len(gzip.decompress(answer)) >= 1024
+        status, headers, answer = self.request("GET", "/user/contacts/")
+        assert status == 200
+        assert "Content-Encoding" not in headers
+        assert headers.get("Vary") == "Accept-Encoding"
+
+    def _sync_page(self, path, sync_token="", nresults=None):
+        """Get the sync token, the changed hrefs with their status and
+        whether the response was truncated."""
+        limit = ("<limit><nresults>%d</nresults></limit>" % nresults
+                 if nresults else "")
+        status, _, answer = self.request(
+            "REPORT", path, """<?xml version="1.0" encoding="utf-8"?>
+<sync-collection xmlns="DAV:">
+  <sync-token>%s</sync-token>
+  <sync-level>1</sync-level>
+  %s
+  <prop><getetag/></prop>
+</sync-collection>""" % (sync_token, limit))
+        assert status == 207
+        xml = DefusedET.fromstring(answer)
+        changes = []
+        truncated = False
+        for response in xml.findall("{DAV:}response"):
+            href = response.find("{DAV:}href").text
+            status = response.find("{DAV:}status")
+            if status is not None and " 507 " in status.text:
+                assert href == path
+                assert response.find(
+                    "{DAV:}error/{DAV:}number-of-matches-within-limits"
+                ) is not None
+                truncated = True
+                continue
+            changes.append((href, status is None))
+        return xml.find("{DAV:}sync-token").text, changes, truncated
+
+    def test_sync_collection_paging(self):
+        cards = "".join(get_vcard("card%d" % i) for i in range(30))
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/", cards, CONTENT_TYPE="text/vcard")
+        assert status == 201
+        sync_token = ""
+        hrefs = []
+        while True:
+            sync_token, changes, truncated = self._sync_page(
+                "/user/contacts/", sync_token, nresults=7)
+            assert len(changes) == 7 if truncated else len(changes) <= 7
+            assert all(found for _, found in changes)
+            hrefs.extend(href for href, _ in changes)
+            if not truncated:
+                break
+        assert len(hrefs) == len(set(hrefs)) == 30
+        status, _, _ = self.request("DELETE", hrefs[0])
+        assert status == 200
+        sync_token, changes, truncated = self._sync_page(
+            "/user/contacts/", sync_token, nresults=7)
+        assert changes == [(hrefs[0], False)]
+        assert not truncated
+        _, changes, _ = self._sync_page("/user/contacts/", sync_token)
+        assert changes == []
+
+    def test_sync_collection_max_results(self):
+        self.configuration.update({"storage": {"max_sync_results": "10"}},
+                                  "test", privileged=True)
+        self.application = Application(self.configuration)
+        cards = "".join(get_vcard("card%d" % i) for i in range(15))
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/", cards, CONTENT_TYPE="text/vcard")
+        assert status == 201
+        sync_token, changes, truncated = self._sync_page("/user/contacts/")
+        assert len(changes) == 10 and truncated
+        _, changes, truncated = self._sync_page(
+            "/user/contacts/", sync_token, nresults=20)
+        assert len(changes) == 5 and not truncated
+
+    def test_put_duplicate_uids(self):
+        """All cards of an address book are stored, even if UIDs repeat."""
+        cards = get_vcard("card") + get_vcard("other") + get_vcard("card")
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/", cards, CONTENT_TYPE="text/vcard")
+        assert status == 201
+        status, _, answer = self.request("GET", "/user/contacts/")
+        assert status == 200
+        assert answer.decode().count("BEGIN:VCARD") == 3
+
+    def test_put_generated_uids(self):
+        card = ("BEGIN:VCARD\r\nVERSION:3.0\r\nFN:Name\r\nN:Name;;;;\r\n"
+                "END:VCARD\r\n")
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/", 3 * card, CONTENT_TYPE="text/vcard")
+        assert status == 201
+        status, _, answer = self.request("GET", "/user/contacts/")
+        assert status == 200
+        assert len(set(re.findall(r"UID:(\S+)", answer.decode()))) == 3
+
+    def _login(self, user):
+        return "Basic " + base64.b64encode(
+            ("%s:password" % user).encode()).decode()
+
+    def test_auto_provision(self):
+        """Collections are only created on login if it's enabled."""
+        status, _, _ = self.request("PROPFIND", "/alice/contacts/",
+                                    HTTP_AUTHORIZATION=self._login("alice"))
+        assert status == 404
+        self.configuration.update({"storage": {"auto_provision": "True"}},
+                                  "test")
+        self.application = Application(self.configuration)
+        status, _, _ = self.request("PROPFIND", "/alice/contacts/",
+                                    HTTP_AUTHORIZATION=self._login("alice"))
+        assert status == 207
@@ -0,0 +1,159 @@
+"""
+Tests for the built-in server.
+
+"""
+
+import http.client
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from CDserver import server
+from CDserver.tests import BaseTest
+
+
+class TestServer(BaseTest):
+
+    asyncio = False
+
+    def setup_method(self):
+        super().setup_method()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.configuration.update({
+            "server": {"hosts": "127.0.0.1:%d" % self.port,
+                       "workers": "2", "timeout": "10",
+                       "asyncio": str(self.asyncio)}},
+            "test", privileged=True)
+        self.shutdown_socket, shutdown_socket_out = socket.socketpair()
+        self.thread = threading.Thread(target=server.serve, args=(
+            self.configuration, shutdown_socket_out))
+        self.thread.start()
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", self.port)).close()
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+
+    def teardown_method(self):
+        self.shutdown_socket.close()
+        self.thread.join()
+        super().teardown_method()
+
+    def test_idle_connections(self):
+        """Idle persistent connections don't occupy workers."""
+        connections = []
+        try:
+            for _ in range(4):
+                connection = http.client.HTTPConnection(
+                    "127.0.0.1", self.port, timeout=5)
+                connections.append(connection)
+                connection.request("GET", "/.web")
+                response = connection.getresponse()
+                response.read()
+                assert not response.will_close
+            # The connections are still usable
+            for connection in connections:
+                connection.request("GET", "/.web")
+                response = connection.getresponse()
+                response.read()
+                assert not response.will_close
+        finally:
+            for connection in connections:
+                connection.close()
+
+    def test_many_idle_connections(self):
+        """File descriptors of idle connections can exceed the limit of
+        ``select``."""
+        resource = pytest.importorskip("resource")
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 2048:
+            pytest.skip("Not enough file descriptors available")
+        resource.setrlimit(resource.RLIMIT_NOFILE, (
+            4096 if hard == resource.RLIM_INFINITY else min(hard, 4096),
+            hard))
+        placeholders = []
+        connections = []
+        try:
+            while len(placeholders) < 1024:
+                placeholders.append(os.open(os.devnull, os.O_RDONLY))
+            for _ in range(64):
+                connection = http.client.HTTPConnection(
+                    "127.0.0.1", self.port, timeout=5)
+                connections.append(connection)
+                connection.request("GET", "/.web")
+                response = connection.getresponse()
+                response.read()
+                assert not response.will_close
+            for connection in connections:
+                connection.request("GET", "/.web")
+                response = connection.getresponse()
+                response.read()
+                assert not response.will_close
+        finally:
+            for connection in connections:
+                connection.close()
+            for fd in placeholders:
+                os.close(fd)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    def _read_response(self, rfile):
+        status = int(rfile.readline().split()[1])
+        headers = {}
+        for line in iter(rfile.readline, b"\r\n"):
+            name, value = line.decode().split(":", 1)
+            headers[name.lower()] = value.strip()
+        if headers.get("transfer-encoding") != "chunked":
+            return status, headers, rfile.read(
+                int(headers["content-length"]))
+        chunks = []
+        for line in iter(rfile.readline, b"0\r\n"):
+            chunks.append(rfile.read(int(line, 16)))
+            rfile.readline()
+        rfile.readline()
+        return status, headers, b"".join(chunks)
+
+    def test_chunked_request_body(self):
+        """The chunked body is decoded and unread bodies are skipped."""
+        card = ("BEGIN:VCARD\r\nVERSION:3.0\r\nUID:card\r\nFN:Name\r\n"
+                "N:Name;;;;\r\nEND:VCARD\r\n").encode()
+        chunked = b"".join(b"%x;ext=1\r\n%s\r\n" % (len(part), part)
+                           for part in (card[:20], card[20:]))
+        chunked += b"0\r\nTrailer: value\r\n\r\n"
+        with socket.create_connection(("127.0.0.1", self.port),
+                                      timeout=5) as sock:
+            sock.sendall(
+                b"MKCOL /user/ HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                b"PUT /user/contacts/ HTTP/1.1\r\n"
+                b"Host: localhost\r\nContent-Type: text/vcard\r\n"
+                b"Transfer-Encoding: chunked\r\n\r\n" + chunked +
+                # The body of the request isn't read by the application
+                b"GET /user/contacts/ HTTP/1.1\r\n"
+                b"Host: localhost\r\nTransfer-Encoding: chunked\r\n\r\n" +
+                chunked)
+            rfile = sock.makefile("rb")
+            assert self._read_response(rfile)[0] == 201
+            assert self._read_response(rfile)[0] == 201
+            status, headers, answer = self._read_response(rfile)
+            assert status == 200
+            assert headers.get("connection") != "close"
+            assert b"UID:card" in answer
+
+    def test_pipelined_requests(self):
+        with socket.create_connection(("127.0.0.1", self.port),
+                                      timeout=5) as sock:
+            sock.sendall(2 * b"GET /.web HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            rfile = sock.makefile("rb")
+            for _ in range(2):
+                _, headers, _ = self._read_response(rfile)
+                assert headers.get("connection") != "close"
+
+
+class TestAsyncServer(TestServer):
+
+    asyncio = True
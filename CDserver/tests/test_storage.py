@@ -0,0 +1,330 @@
+"""
+Tests for the multifilesystem storage.
+
+"""
+
+import os
+import re
+import threading
+import time
+
+import pytest
+
+from CDserver import Application, pathutils
+from CDserver.storage.multifilesystem import (durability, hook,
+                                              maintenance)
+from CDserver.tests import BaseTest, get_vcard
+
+
+class TestMultiFileSystem(BaseTest):
+
+    def setup_method(self):
+        super().setup_method()
+        status, _, _ = self.request("MKCOL", "/user/")
+        assert status == 201
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/", "".join(
+                get_vcard("card%d" % i) for i in range(3)),
+            CONTENT_TYPE="text/vcard")
+        assert status == 201
+
+    def _get_ctag(self, path):
+        status, _, answer = self.request(
+            "PROPFIND", path, """<?xml version="1.0" encoding="utf-8"?>
+<propfind xmlns="DAV:" xmlns:CS="http://calendarserver.org/ns/">
+  <prop><CS:getctag/></prop>
+</propfind>""", HTTP_DEPTH="0")
+        assert status == 207
+        return re.search(r"<CS:getctag>([^<]*)</CS:getctag>",
+                         answer.decode()).group(1)
+
+    def _edit_in_place(self, href):
+        """Edit the item and let the maintenance find the change."""
+        path = os.path.join(self.colpath, "collection-root", "user",
+                            "contacts", href)
+        with open(path, "w", newline="") as f:
+            f.write(get_vcard(href[:-len(".vcf")], "Edited name"))
+        assert self.application._storage.maintain()
+
+    def test_ctag_after_edit_in_place(self):
+        """Editing an item doesn't change the modification time of the
+        folder, the maintenance finds it."""
+        ctag = self._get_ctag("/user/contacts/")
+        assert self._get_ctag("/user/contacts/") == ctag
+        self._edit_in_place("card1.vcf")
+        new_ctag = self._get_ctag("/user/contacts/")
+        assert new_ctag != ctag
+        # The cache of a new process
+        self.application = Application(self.configuration)
+        assert self._get_ctag("/user/contacts/") == new_ctag
+        self._edit_in_place("card2.vcf")
+        assert self._get_ctag("/user/contacts/") not in (ctag, new_ctag)
+
+    def _sync(self, path, sync_token=""):
+        status, _, answer = self.request(
+            "REPORT", path, """<?xml version="1.0" encoding="utf-8"?>
+<sync-collection xmlns="DAV:">
+  <sync-token>%s</sync-token>
+  <sync-level>1</sync-level>
+  <prop><getetag/></prop>
+</sync-collection>""" % sync_token)
+        assert status == 207
+        answer = answer.decode()
+        sync_token = re.search(r"<sync-token[^>]*>([^<]*)</sync-token>",
+                               answer).group(1)
+        return sync_token, re.findall(r"<href>([^<]*)</href>", answer)
+
+    def test_sync_after_edit_in_place(self):
+        sync_token, hrefs = self._sync("/user/contacts/")
+        assert len(hrefs) == 3
+        self._edit_in_place("card1.vcf")
+        sync_token, hrefs = self._sync("/user/contacts/", sync_token)
+        assert hrefs == ["/user/contacts/card1.vcf"]
+        self._edit_in_place("card2.vcf")
+        # The cache of a new process
+        self.application = Application(self.configuration)
+        sync_token, hrefs = self._sync("/user/contacts/", sync_token)
+        assert hrefs == ["/user/contacts/card2.vcf"]
+        _, hrefs = self._sync("/user/contacts/", sync_token)
+        assert hrefs == []
+
+    def _check_snapshot(self, method, data=None):
+        """Items of a snapshot can be read after ``method`` on the
+        collection by another process."""
+        self.configuration.update({
+            "storage": {"memory_cache_text": "False"}}, "test")
+        self.application = Application(self.configuration)
+        folder = os.path.join(self.colpath, "collection-root", "user",
+                              "contacts")
+        for href in os.listdir(folder):
+            # The items are only read when they are used if the files
+            # weren't modified recently
+            os.utime(os.path.join(folder, href), (0, 0))
+        storage = self.application._storage
+        with storage.acquire_lock("r", "user"):
+            collection, = storage.discover("/user/contacts/")
+            # The first listing stores the metadata of the files
+            list(collection.get_all())
+            items = list(collection.get_all())
+        assert len(items) == 3
+        # The cache of another process
+        self.application = Application(self.configuration)
+        status, _, _ = self.request(method, "/user/contacts/", data,
+                                    CONTENT_TYPE="text/vcard")
+        assert status in (200, 201)
+        for item in items:
+            assert "FN:Name" in item.serialize()
+
+    def test_snapshot_after_replace(self):
+        self._check_snapshot("PUT", "".join(
+            get_vcard("card%d" % i, "Replaced") for i in range(3)))
+
+    def test_snapshot_after_delete(self):
+        self._check_snapshot("DELETE")
+
+    def test_uid_conflict(self):
+        """The UID index follows uploads, deletions and edits in place."""
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/other.vcf", get_vcard("card1"),
+            CONTENT_TYPE="text/vcard")
+        assert status == 409
+        status, _, _ = self.request("DELETE", "/user/contacts/card1.vcf")
+        assert status == 200
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/other.vcf", get_vcard("card1"),
+            CONTENT_TYPE="text/vcard")
+        assert status == 201
+        path = os.path.join(self.colpath, "collection-root", "user",
+                            "contacts", "card2.vcf")
+        with open(path, "w", newline="") as f:
+            f.write(get_vcard("edited"))
+        assert self.application._storage.maintain()
+        # The cache of a new process
+        self.application = Application(self.configuration)
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/card2-copy.vcf", get_vcard("card2"),
+            CONTENT_TYPE="text/vcard")
+        assert status == 201
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/edited.vcf", get_vcard("edited"),
+            CONTENT_TYPE="text/vcard")
+        assert status == 409
+
+    def test_maintenance_in_batches(self, monkeypatch):
+        """The lock is released between batches of items."""
+        monkeypatch.setattr(maintenance, "ITEM_BATCH_SIZE", 2)
+        storage = self.application._storage
+        acquire_lock = storage._acquire_lock
+        locked = []
+        batches = []
+
+        def _acquire_lock(*args, **kwargs):
+            locked.append(args)
+            return acquire_lock(*args, **kwargs)
+
+        def _maintain_items(collection, hrefs):
+            batches.append((len(locked), len(hrefs)))
+        monkeypatch.setattr(storage, "_acquire_lock", _acquire_lock)
+        monkeypatch.setattr(storage._collection_class, "_maintain_items",
+                            _maintain_items)
+        assert storage.maintain()
+        # Only the address book contains items
+        assert len(batches) == 2
+        # Each batch was checked with its own lock
+        assert [count for count, _ in batches] == [
+            len(locked) - 1, len(locked)]
+        assert sorted(size for _, size in batches) == [1, 2]
+
+
+    def _record_syncs(self, monkeypatch, mode):
+        """Enable syncing in ``mode`` and record the synced paths."""
+        if not os.path.isdir("/proc/self/fd"):
+            pytest.skip("Requires /proc")
+        self.configuration.update({"storage": {
+            "filesystem_sync": mode, "_filesystem_fsync": "True"}},
+            "test", privileged=True)
+        self.application = Application(self.configuration)
+        synced = []
+        monkeypatch.setattr(pathutils, "fsync", lambda fd: synced.append(
+            os.readlink("/proc/self/fd/%d" % fd)))
+        monkeypatch.setattr(pathutils, "syncfs",
+                            lambda path: synced.append(None))
+        return synced
+
+    def _put_card(self, synced):
+        # The journal is only written after it was used
+        self._sync("/user/contacts/")
+        synced.clear()
+        status, _, _ = self.request(
+            "PUT", "/user/contacts/card9.vcf", get_vcard("card9"),
+            CONTENT_TYPE="text/vcard")
+        assert status == 201
+        folder = os.path.realpath(os.path.join(
+            self.colpath, "collection-root", "user", "contacts"))
+        return folder, os.path.join(folder, ".CDserver.cache", "journal")
+
+    def test_sync_always(self, monkeypatch):
+        synced = self._record_syncs(monkeypatch, "always")
+        folder, journal = self._put_card(synced)
+        assert folder in synced and journal in synced
+        assert None not in synced
+
+    def test_sync_request(self, monkeypatch):
+        """The folders and the journal are synced once at the end of the
+        request."""
+        synced = self._record_syncs(monkeypatch, "request")
+        folder, journal = self._put_card(synced)
+        # The item is synced before it's renamed, the folder and the
+        # journal at the end, caches aren't synced
+        assert synced[0].startswith(os.path.join(folder, ".CDserver.tmp-"))
+        assert sorted(synced[1:]) == sorted([folder, journal])
+
+    def test_sync_group(self, monkeypatch):
+        """The filesystem is synced instead of the folders."""
+        monkeypatch.setattr(pathutils, "HAVE_SYNCFS", True)
+        synced = self._record_syncs(monkeypatch, "group")
+        folder, journal = self._put_card(synced)
+        assert synced.count(None) == 1 and synced[-1] is None
+        assert folder not in synced and journal not in synced
+
+
+class TestHookRunner:
+
+    def _runner(self, folder, delay=0.05):
+        return hook.HookRunner(
+            "echo start %(user)s >> log; sleep 0.1; echo end >> log",
+            str(folder), delay)
+
+    def _log(self, folder):
+        with open(os.path.join(folder, "log")) as f:
+            return f.read().split("\n")[:-1]
+
+    def test_serialized_runs(self, tmp_path):
+        """Runs of different runners (e.g. processes) don't overlap."""
+        runners = [self._runner(tmp_path) for _ in range(2)]
+        for i, runner in enumerate(runners):
+            runner.schedule("user%d" % i)
+        for runner in runners:
+            runner.close()
+        log = self._log(tmp_path)
+        assert sorted(log[0::2]) == ["start user0", "start user1"]
+        assert log[1::2] == ["end", "end"]
+
+    def test_coalesced_runs(self, tmp_path):
+        """A run that started after a change includes it."""
+        runners = [self._runner(tmp_path, delay=0.3) for _ in range(2)]
+        for runner in runners:
+            runner.schedule("user")
+        runners[0].schedule("user")
+        for runner in runners:
+            runner.close()
+        assert self._log(tmp_path) == ["start user", "end"]
+        assert runners[0].coalesced == 1 and runners[1].coalesced == 1
+        assert runners[0].runs + runners[1].runs == 1
+
+    def test_schedule_after_close(self, tmp_path):
+        runner = self._runner(tmp_path)
+        runner.close()
+        runner.schedule("user")
+        assert self._log(tmp_path) == ["start user", "end"]
+        assert runner.runs == 1
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires fork")
+class TestRwLock:
+
+    def test_lock_after_fork(self, tmp_path):
+        """Forked processes don't inherit the locks of the parent."""
+        lock = pathutils.RwLock(str(tmp_path / "lock"))
+        read_fd, write_fd = os.pipe()
+        with lock.acquire("r"):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    os.close(read_fd)
+                    if not lock.locked:
+                        with lock.acquire("w"):
+                            os.write(write_fd, b"%f" % time.time())
+                        status = 0
+                finally:
+                    os._exit(status)
+            os.close(write_fd)
+            time.sleep(0.2)
+            released = time.time()
+        with os.fdopen(read_fd, "rb") as f:
+            acquired = float(f.read() or 0)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert acquired >= released
+        # The lock of the parent is still usable
+        with lock.acquire("w"):
+            pass
+
+
+class TestGroupSync:
+
+    def test_concurrent_syncs(self):
+        """Requests that arrive during a sync are synced together."""
+        started = threading.Event()
+        release = threading.Event()
+        groups = []
+
+        def sync_paths(paths):
+            groups.append(set(paths))
+            started.set()
+            release.wait(5)
+        group_sync = durability.GroupSync(sync_paths)
+        threads = [threading.Thread(target=group_sync.sync, args=({path},))
+                   for path in ("a", "b", "c")]
+        threads[0].start()
+        assert started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while group_sync.requests < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert groups == [{"a"}, {"b", "c"}]
+        assert group_sync.syncs == 2